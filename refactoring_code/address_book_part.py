@@ -1,101 +1,455 @@
 from record_part import Record
 from fields_part import Name, Birthday, Phone, Email, Address, Note
+from index_part import NGramIndex, PhoneTrieIndex, TagIndex, NoteTextIndex, NameIndex, SortedIndex, birthday_ranges
+from storage_part import Journal, SnapshotRecords, file_stamp
 from _collections_abc import Iterator
+from datetime import datetime
+from abc import abstractmethod, ABC
+import calendar
 from collections import UserDict
-import pickle
+from itertools import count
+import base64
+import heapq
+import json
+
+
+# Cursors are opaque strings of the last (sort value, key) seen, a page starts right after it,
+# so records added meanwhile don't shift the following pages
+def encode_cursor(sort, value, key):
+    return base64.urlsafe_b64encode(json.dumps([sort, value, key]).encode()).decode()
+
+def decode_cursor(cursor, sort):  # (value, key) of the position
+    try:
+        cursor_sort, value, key = json.loads(base64.urlsafe_b64decode(cursor))
+    except Exception:
+        raise ValueError('Cursor is not valid')
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor belongs to '{cursor_sort}' sort order")
+    return (tuple(value) if isinstance(value, list) else value), key
+
+
+# Sort values of the sorted indexes, records without the value are not listed in that order
+def birthday_value(key, record):  # (month, day) in calendar order
+    birthday = record.birthday.value if record.birthday else None
+    return (birthday.month, birthday.day) if birthday else None
+
+def email_domain_value(key, record):
+    email = record.email.value if record.email else None
+    return email.partition('@')[2].lower() if email else None
+
+
+# Abstraction for contact storages, the user interface works only through it
+class AddressBookAbstraction(ABC):
+    PAGE_SIZE = 2  # records on a page of the contact list
+
+    @abstractmethod
+    def add_record(self, record):
+        pass
+    @abstractmethod
+    def add_records(self, records):
+        pass
+    @abstractmethod
+    def find(self, name):
+        pass
+    @abstractmethod
+    def delete(self, name):
+        pass
+    @abstractmethod
+    def search(self, query):
+        pass
+    @abstractmethod
+    def find_similar(self, name, limit=5, max_distance=2):
+        pass
+    @abstractmethod
+    def record_changed(self, record):
+        pass
+    @abstractmethod
+    def birthday_candidates(self, today, days):
+        pass
+    @abstractmethod
+    def find_by_tag(self, tag):
+        pass
+    @abstractmethod
+    def search_notes(self, text, limit=None):
+        pass
+    @abstractmethod
+    def notes_tagged(self, tag):
+        pass
+    @abstractmethod
+    def tag_counts(self):
+        pass
+    @abstractmethod
+    def save_to_file(self, filename):
+        pass
+    @abstractmethod
+    def restore_from_file(self, filename):
+        pass
+    @abstractmethod
+    def page(self, cursor=None, page_size=None, sort='added'):
+        pass
+    @abstractmethod
+    def range(self, sort, start=None, stop=None):
+        pass
+    @abstractmethod
+    def __iter__(self):
+        pass
+
+# Method returns iterator over pages, it can be resumed later from its cursor
+    def pages(self, page_size=None, sort='added', cursor=None):
+        return AddressBookIterator(self, page_size or self.PAGE_SIZE, sort, cursor)
+
+# Method returns (record, days) of birthdays in the next days, the nearest first
+    def upcoming_birthdays(self, days):
+        today = datetime.now().date()
+        upcoming = []
+        for record in self.birthday_candidates(today, days):
+            days_left = record.days_to_birthday(today)
+            if days_left <= days:
+                upcoming.append((record, days_left))
+        upcoming.sort(key=lambda item: item[1])
+        return upcoming
+
+# Method yields (tag, [(record, note)]) for every tag in alphabetical order
+    def tag_listing(self):
+        for tag in self.tag_counts():
+            yield tag, self.notes_tagged(tag)
+
+# Method yields records one by one in the book order, e.g. for export
+    def iter_records(self):
+        for page in self:
+            yield from page
+
+# Methods for user interaction, to retrieve contact record
+    def validate_input(self, prompt, validation_func):
+        while True:
+            user_input = input(prompt)
+            try:
+                validation_func(user_input)
+                return user_input
+            except ValueError as e:
+                print(f"Error: {e}")
+
+    def get_contact(self):
+        name = self.validate_input("Enter name: ", lambda x: Name(x))
+        address = self.validate_input("Enter Address: ", lambda x: Address(x))
+        phone = self.validate_input("Enter UA mobile phone(10 numbers, start from 0): ", lambda x: Phone(x))
+        email = self.validate_input("Enter email: ", lambda x: Email(x))
+        birthday = self.validate_input("Enter birthday (YYYY-MM-DD): ", lambda x: Birthday(x))
+        note = self.validate_input("Enter note: ", lambda x: Note(x))
+        tag = self.validate_input("Input tag message: ", lambda x: Note(x))
+        message = f"{note} #{tag}" if tag else f"{note}"
+        return Record(name, phone, birthday, email, message, address)
 
 
 # Class store all contacts and main logic contacts processing
-class AddressBook(UserDict):
+class AddressBook(UserDict, AddressBookAbstraction):
+    COMPACT_MIN_ENTRIES = 1000  # journal is folded into the snapshot after that
+
+    def __init__(self, *args, **kwargs):
+        self.text_index = NGramIndex()
+        self.phone_index = PhoneTrieIndex()
+        self.tag_index = TagIndex()
+        self.note_index = NoteTextIndex()  # saved next to the snapshot, not rebuilt on restore
+        self.name_index = NameIndex()
+        self.sorted_indexes = {  # sort order of pages -> keys sorted by it
+            'added': SortedIndex(lambda key, record: self._order[key], uses_record=False),
+            'name': SortedIndex(lambda key, record: key, uses_record=False),
+            'birthday': SortedIndex(birthday_value),
+            'email': SortedIndex(email_domain_value),
+            # most recently modified first, sequence numbers are kept in the snapshot index
+            'modified': SortedIndex(lambda key, record: -self._modified[key], uses_record=False),
+        }
+        self.indexes = [self.text_index, self.phone_index, self.tag_index, self.note_index,
+                        self.name_index, *self.sorted_indexes.values()]
+        self.active_indexes = list(self.indexes)  # indexes updated on mutations
+        self._order = {}  # key -> insertion number, keeps results in dict order
+        self._counter = count()
+        self._modified = {}  # key -> modification sequence number, from the same counter
+        self.version = 0  # incremented by every mutation, marks derived snapshots stale
+        self.indexed = True  # indexes are built on first query after restore_from_file
+        self.journal = None  # attached by restore_from_file, logs every mutation
+        self._birthday_columns = None
+        self.filename = None
+        super().__init__()
+        self.data = SnapshotRecords(on_load=self._attach)
+        self.update(*args, **kwargs)
+
+    def _attach(self, record):
+        record._book = self
+
+# Methods keep indexes in sync with stored records
+    def __setitem__(self, key, record):
+        self._set(key, record)
+        self._mutated('set', key, record)
+
+    def _set(self, key, record):
+        if key not in self.data:
+            self._order[key] = next(self._counter)
+        self._modified[key] = next(self._counter)
+        self._unindex(key)  # loaded index may hold the key replayed from the journal
+        self.data[key] = record
+        record._book = self
+        for index in self.active_indexes:
+            index.add(key, record)
+
+    def __delitem__(self, key):
+        self._unindex(key)
+        del self.data[key]
+        self._order.pop(key, None)
+        self._modified.pop(key, None)
+        self._mutated('del', key)
+
+    def _unindex(self, key):
+        record = self.data.loaded(key)
+        if record is not None:
+            record._book = None
+        for index in self.active_indexes:
+            index.remove(key)
+
+    def record_changed(self, record):  # called by Record after each mutation
+        key = record.name.value
+        if self.data.loaded(key) is record:
+            self._modified[key] = next(self._counter)
+            for index in self.active_indexes:
+                index.remove(key)
+                index.add(key, record)
+            self._mutated('set', key, record)
+
+    def _mutated(self, operation, key, record=None):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.append(operation, key, record)
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if self.journal.entries > max(self.COMPACT_MIN_ENTRIES, len(self.data)):
+            self.compact()
+
+    def reindex(self):  # decodes every record, so it runs only when a query needs indexes
+        stale_indexes = [index for index in self.indexes if index not in self.active_indexes]
+        items = list(self.data.items())
+        for index in stale_indexes:
+            index.clear()
+            index.extend(items)
+        self.active_indexes = list(self.indexes)
+        self.indexed = True
+
+    def _ensure_indexed(self, index=None):  # every index, or only the given one if it is already built
+        if not self.indexed and (index is None or index not in self.active_indexes):
+            self.reindex()
+
     # ID = 1
     def add_record(self, record: Record):  # add record in dictionary
         key = record.name.value
         # key = self.ID
         # self.ID += 1
-        self.data[key] = record
+        self[key] = record
         # print(f"{key}.{self.data[key]}")
         return f"Contact {record.name.value} added"
+
+    def add_records(self, records):  # bulk add, e.g. from importer, journaled with one flush
+        entries = []
+        for record in records:
+            key = record.name.value
+            self._set(key, record)
+            entries.append(('set', key, record))
+        self.version += 1
+        if self.journal is not None:
+            self.journal.extend(entries)
+            self._compact_if_needed()
+        return f"{len(entries)} contacts added"
+
     def find(self, name):   # get record in dictionary
         return self.data.get(name)
 
     def delete(self, name):  # delete contact in dictionary
         if name in self.data:
-            del self.data[name]
+            del self[name]
             return f'Record {name} deleted'
         else:
             raise KeyError(f"Contact '{name}' not found.")
 
+    def find_similar(self, name, limit=5, max_distance=2):  # (record, distance) of names with typos, nearest first
+        self._ensure_indexed(self.name_index)
+        return [(self.data[key], distance) for distance, key in self.name_index.closest(name, limit, max_distance)]
+
+    def find_by_phone_prefix(self, prefix):  # records with a phone starting from prefix
+        self._ensure_indexed()
+        keys = self.phone_index.with_prefix(prefix)
+        return [self.data[key] for key in sorted(keys, key=self._order.get)]
+
+    def find_by_phone(self, number):  # records who own the phone number
+        self._ensure_indexed()
+        keys = self.phone_index.owners(number)
+        return [self.data[key] for key in sorted(keys, key=self._order.get)]
+
+    def birthday_candidates(self, today, days):  # range scans of the birthday sort order
+        index = self.sorted_indexes['birthday']
+        self._ensure_indexed(index)
+        return [self.data[key] for first, last in birthday_ranges(today, days)
+                for key in index.range(first, (last[0], last[1] + 1))]
+
+    def find_by_tag(self, tag):  # records with at least one note tagged #tag
+        self._ensure_indexed()
+        return [self.data[key] for key in sorted(self.tag_index.notes(tag), key=self._order.get)]
+
+    def notes_tagged(self, tag):  # (record, note) of every note tagged #tag
+        self._ensure_indexed()
+        notes = self.tag_index.notes(tag)
+        result = []
+        for key in sorted(notes, key=self._order.get):
+            record = self.data[key]
+            result.extend((record, record.notes[position]) for position in notes[key])
+        return result
+
+    def tag_counts(self):  # tag -> quantity of notes tagged with it, in alphabetical order
+        self._ensure_indexed()
+        return {tag: self.tag_index.counts[tag] for tag in self.tag_index.sorted_tags}
+
+    def search_notes(self, text, limit=None):  # records with notes having every word, best BM25 match first
+        self._ensure_indexed(self.note_index)
+        scores = {}
+        for score, (key, position) in self.note_index.search(text):
+            scores[key] = max(score, scores.get(key, score))
+        best = heapq.nsmallest(len(scores) if limit is None else limit, scores.items(),
+                               key=lambda item: (-item[1], item[0]))
+        return [self.data[key] for key, score in best]
+
+    def birthday_columns(self):  # numpy snapshot for bulk birthday reports, rebuilt after changes
+        from analytics_part import BirthdayColumns  # numpy is needed only for the reports
+        if self._birthday_columns is None or self._birthday_columns.version != self.version:
+            self._birthday_columns = BirthdayColumns(self)
+        return self._birthday_columns
+
     def save_to_file(self, filename):     # serialization data to file
-        with open(filename, 'wb') as file_write:
-            pickle.dump(self.data, file_write)
-            return f'exit'
+        if self.journal is not None and filename == self.filename:
+            if file_stamp(filename) is None or self.data.map is None and len(self.data):
+                self.compact()  # first save of a new book or of an old whole-dict pickle writes the mapped snapshot
+            else:
+                self.journal.sync()  # changes are already journaled, make them durable
+                self._save_note_index(filename)
+        else:
+            self.data.save(filename, self._modified)
+            self._save_note_index(filename)
+        return f'exit'
+
+    def compact(self):  # fold the journal into a fresh snapshot
+        self.data.save(self.filename, self._modified)
+        self.journal.truncate()
+        self._save_note_index(self.filename)
 
-    def restore_from_file(self, filename):  # deserialization data from file
-        with open(filename, 'rb') as file_read:
-            self.data = pickle.load(file_read)
+    def _save_note_index(self, filename):
+        # written once per snapshot file, as soon as the index is built. The index belongs to the snapshot
+        # with the stamp, journal entries are replayed into it on restore, replaying those it already has is harmless
+        stamp = file_stamp(filename)
+        if stamp is not None and self.note_index in self.active_indexes and self.note_index.saved != (filename, stamp):
+            self.note_index.save(filename, stamp)
+
+    def restore_from_file(self, filename):  # deserialization snapshot and journal replay
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        self.data.open(filename)
+        self.version += 1
+        for index in self.indexes:
+            index.clear()
+        saved = self.data.modified
+        self._counter = count(max(saved.values(), default=-1) + 1)  # replayed changes come after saved ones
+        self._order = {key: next(self._counter) for key in self.data}
+        self._modified = {key: saved.get(key, self._order[key]) for key in self.data}
+        self.indexed = False
+        self.active_indexes = [index for index in self.indexes if not index.uses_record]
+        for index in self.active_indexes:
+            index.extend((key, None) for key in self.data)
+        stamp = file_stamp(filename)
+        if stamp is not None and self.note_index.load(filename, stamp):
+            self.active_indexes.append(self.note_index)
+        journal = Journal(filename)
+        for operation, key, record in journal.replay():
+            if operation == 'set':
+                self[key] = record
+            elif key in self.data:
+                del self[key]
+            else:
+                self._unindex(key)
+        self.journal = journal
+        self.filename = filename
 
     def search(self, query):
         query = query.lower()
+        self._ensure_indexed()
+        candidates = self.text_index.candidates(query)
+        if candidates is None:
+            records = self.data.values()
+        else:
+            records = (self.data[key] for key in sorted(candidates, key=self._order.get))
         results = []
-        for record in self.data.values():
+        for record in records:
             if (query in record.name.value.lower() or
                 any(query in phone.value for phone in record.phones) or
                 any(query in note.value.lower() for note in record.notes)):
                 results.append(record)
         return results
     
-# Methods for user interaction, to retrieve contact record
-    def validate_input(self, prompt, validation_func):
-        while True:
-            user_input = input(prompt)
-            try:
-                validation_func(user_input)
-                return user_input
-            except ValueError as e:
-                print(f"Error: {e}")
+    def iter_records(self):  # records not decoded yet are read for the pass only, use find() to edit them
+        for key in list(self.data):
+            yield self.data.peek(key)
 
-    def get_contact(self):
-        name = self.validate_input("Enter name: ", lambda x: Name(x))
-        address = self.validate_input("Enter Address: ", lambda x: Address(x))
-        phone = self.validate_input("Enter UA mobile phone(10 numbers, start from 0): ", lambda x: Phone(x))
-        email = self.validate_input("Enter email: ", lambda x: Email(x))
-        birthday = self.validate_input("Enter birthday (YYYY-MM-DD): ", lambda x: Birthday(x))
-        note = self.validate_input("Enter note: ", lambda x: Note(x))
-        tag = self.validate_input("Input tag message: ", lambda x: Note(x))
-        message = f"{note} #{tag}" if tag else f"{note}"
-        return Record(name, phone, birthday, email, message, address)
+# Methods for page view of the contact list
+    def page(self, cursor=None, page_size=None, sort='added'):  # (records, cursor after the last of them)
+        if sort not in self.sorted_indexes:
+            raise ValueError(f"Unknown sort order '{sort}'")
+        self._ensure_indexed(self.sorted_indexes[sort])
+        position = decode_cursor(cursor, sort) if cursor else None
+        entries = self.sorted_indexes[sort].after(position, page_size or self.PAGE_SIZE)
+        if entries:
+            cursor = encode_cursor(sort, *entries[-1])
+        return [self.data[key] for value, key in entries], cursor
+
+    def range(self, sort, start=None, stop=None):  # records with start <= sort value < stop, e.g. ('name', 'K', 'N')
+        if sort not in self.sorted_indexes:
+            raise ValueError(f"Unknown sort order '{sort}'")
+        index = self.sorted_indexes[sort]
+        self._ensure_indexed(index)
+        return [self.data[key] for key in index.range(start, stop)]
+
+    def next_birthdays(self, limit, today=None):  # (record, days) of the nearest birthdays, whatever far they are
+        today = today or datetime.now().date()
+        index = self.sorted_indexes['birthday']
+        self._ensure_indexed(index)
+        start = (today.month, today.day)
+        if start == (3, 1) and not calendar.isleap(today.year):
+            start = (2, 29)  # Feb 29 birthdays are celebrated today
+        return [(record, record.days_to_birthday(today))
+                for record in map(self.data.__getitem__, index.rotated(start, limit))]
 
-# Method for page view of the contact list
     def __iter__(self) -> Iterator:
         # Iterable class
-        return AddressBookIterator(self.data.values(), page_size=2)
+        return self.pages()
 # Methods readeble view
     def __repr__(self):
         return f"AddressBook({self.data})"
 
-# Class iterator
+# Class iterator, records are taken from the book page by page,
+# cursor of the last page is kept to continue the listing later
 class AddressBookIterator:
-    def __init__(self, records_list, page_size):
-        self.records = list(records_list)
+    def __init__(self, book, page_size, sort='added', cursor=None):
+        self.book = book
         self.page_size = page_size
-        self.counter = 0  # quantity on page
-        # use for showing part of the reccords that size < page_size
-        self.page = len(self.records) // self.page_size
+        self.sort = sort
+        self.cursor = cursor
+        self.finished = False
+
+    def __iter__(self):
+        return self
 
     def __next__(self):
-        if self.counter >= len(self.records):
+        if self.finished:
+            raise StopIteration
+        result, self.cursor = self.book.page(self.cursor, self.page_size, self.sort)
+        self.finished = len(result) < self.page_size
+        if not result:
             raise StopIteration
-        else:
-            if self.page > 0:
-                # slice reccords on the page
-                result = list(
-                    self.records[self.counter:self.counter + self.page_size])
-                self.page -= 1
-                self.counter += self.page_size
-            else:
-                # the rest of the records on the page
-                result = list(self.records[self.counter:])
-                self.counter = len(self.records)
         return result
 
 if __name__ == '__main__':    
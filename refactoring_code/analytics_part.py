@@ -0,0 +1,58 @@
+from datetime import datetime
+import numpy as np
+
+# Columnar snapshot of contact birthdays for bulk reports, built by AddressBook.birthday_columns
+class BirthdayColumns:
+    WEEKS = 53
+
+    def __init__(self, book):
+        keys = []
+        birthdays = []
+        for key in book.data:
+            record = book.data.peek(key)  # records of the mapped snapshot aren't kept decoded
+            if record.birthday and record.birthday.value:
+                keys.append(key)
+                birthdays.append(record.birthday.value)
+        self.book = book
+        self.version = book.version  # snapshot is stale once the book version changes
+        self.keys = np.array(keys, dtype=object)
+        self.birthdays = np.array(birthdays, dtype='datetime64[D]')
+        month_starts = self.birthdays.astype('datetime64[M]')
+        self.months = month_starts.astype(np.int64) % 12  # 0 for January
+        self.days = (self.birthdays - month_starts.astype('datetime64[D]')).astype(np.int64)  # 0 for 1st
+        self.years = month_starts.astype('datetime64[Y]').astype(np.int64) + 1970
+
+    def __len__(self):
+        return len(self.keys)
+
+    def records(self, mask):
+        return [self.book.data[key] for key in self.keys[mask]]
+
+    def birthdays_in_year(self, year):  # Feb 29 becomes Mar 1 in common years, as in Record
+        year_start = np.datetime64(f'{year:04d}-01', 'M')
+        return (year_start + self.months).astype('datetime64[D]') + self.days
+
+    def days_to_birthday(self, today=None):  # batched Record.days_to_birthday
+        today = np.datetime64(today or datetime.now().date(), 'D')
+        year = today.astype('datetime64[Y]').astype(np.int64) + 1970
+        next_birthdays = self.birthdays_in_year(year)
+        passed = next_birthdays < today
+        next_birthdays[passed] = self.birthdays_in_year(year + 1)[passed]
+        return (next_birthdays - today).astype(np.int64)
+
+    def ages(self, today=None):
+        today = np.datetime64(today or datetime.now().date(), 'D')
+        year = today.astype('datetime64[Y]').astype(np.int64) + 1970
+        return year - self.years - (self.birthdays_in_year(year) > today)
+
+    def weeks_histogram(self):  # birthdays per week of the year, Feb 29 counted in its own week
+        day_of_year = (self.birthdays_in_year(2000) - np.datetime64('2000-01-01', 'D')).astype(np.int64)
+        return np.bincount(day_of_year // 7, minlength=self.WEEKS)
+
+    def age_histogram(self, bin_width=10, today=None):  # counts for ages [0, w), [w, 2w), ...
+        ages = self.ages(today)
+        return np.bincount(np.maximum(ages, 0) // bin_width) if len(ages) else np.zeros(0, np.int64)
+
+    def in_window(self, start, end):  # records with birthday between start and end dates inclusive
+        window = (np.datetime64(end, 'D') - np.datetime64(start, 'D')).astype(np.int64)
+        return self.records(self.days_to_birthday(start) <= window)
@@ -1,179 +1,691 @@
+import gzip
 import shutil
+import tarfile
+import zipfile
+from collections import deque, namedtuple
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from queue import Queue
+from threading import Thread, Lock
+import hashlib
+import json
+import multiprocessing
+import os
 import re
+import time
 
-#////////////////start_clean_function////////////////
+#////////////////start_normalize////////////////
+CYRILLIC_SYMBOLS = 'абвгдеєжзіийклмнопрстуфхцчшщьюяєїґ'
+TRANSLATION = ("a", "b", "v", "h", "d", "e", "ie", "j", "z", "i", "y", "j", "k", "l", "m", "n", "o", "p", "r", "s", "t", "u",
+            "f", "kh", "ts", "ch", "sh", "shch", "", "iy", "ia", "e", "yi", "h")
+ACCORD = dict()
+for cyril, latin in zip(CYRILLIC_SYMBOLS, TRANSLATION):
+    ACCORD[ord(cyril)] = latin
+    ACCORD[ord(cyril.upper())] = latin.capitalize()
+TRANSLATE_TABLE = str.maketrans(ACCORD)  # built once per process, not per clean() call
+NOT_NAME_SYMBOL = re.compile(r'[^\w.]')
+NORMALIZE_CACHE_SIZE = 1 << 16  # repeated names (IMG_0001.jpg, ...) are translated once
+
+@lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize(name: str) -> str:
+    return NOT_NAME_SYMBOL.sub('_', name.translate(TRANSLATE_TABLE))
+
+def normalize_many(names) -> list:
+    return [normalize(name) for name in names]
+
+def get_extension(name: str) -> str:  # same suffix as Path(name).suffix, no Path object
+    dot = name.rfind('.')
+    return name[dot + 1:].upper() if 0 < dot < len(name) - 1 else ''
+
+def benchmark_normalize(count=1000000, distinct=10000):
+    # per-file time of the old normalize, rebuilt with every clean() call, and of the cached one
+    names = [f"Фото відпустки {i % distinct} (копія).JPG" for i in range(count)]
+
+    def old_normalize_run(names):
+        accord = dict()
+        for cyril, latin in zip(CYRILLIC_SYMBOLS, TRANSLATION):
+            accord[ord(cyril)] = latin
+            accord[ord(cyril.upper())] = latin.capitalize()
+        for name in names:
+            re.sub(r'[^\w.]', '_', name.translate(accord))
+            Path(name).suffix[1:].upper()
+
+    def new_normalize_run(names):
+        normalize.cache_clear()
+        normalize_many(names)
+        for name in names:
+            get_extension(name)
+
+    results = {}
+    for title, run in (('old', old_normalize_run), ('new', new_normalize_run)):
+        start = time.perf_counter()
+        run(names)
+        results[title] = (time.perf_counter() - start) / count * 1e6
+    return results  # microseconds per file
+#////////////////end_normalize////////////////
+
+#////////////////start_extension_registry////////////////
+HANDLER_NAMES = ('media', 'archive')  # 'media' moves the file, 'archive' extracts it
+
+# Where files of one extension go: folder / category / subfolder, and how they are handled
+ExtensionRule = namedtuple('ExtensionRule', 'category subfolder handler')
+
+# Class maps extension -> ExtensionRule, every file is routed by one dict lookup.
+# Rules can be registered in code or loaded from JSON config of the form
+# {"images": {"extensions": ["JPEG", "JPG"]}, "archives": {"extensions": ["ZIP"], "handler": "archive"}},
+# optional "subfolders" maps extension -> subfolder name, extension itself by default
+class ExtensionRegistry:
+    def __init__(self, default=ExtensionRule('not_defined', '', 'media')):
+        self.rules = {}
+        self.default = default  # rule of unknown extensions and files without extension
+
+    def register(self, extension: str, category: str, subfolder=None, handler='media'):
+        if handler not in HANDLER_NAMES:
+            raise ValueError(f"Handler should be one of {', '.join(HANDLER_NAMES)}")
+        extension = extension.upper()
+        self.rules[extension] = ExtensionRule(category, extension if subfolder is None else subfolder, handler)
+
+    def update(self, config: dict):
+        for category, settings in config.items():
+            subfolders = settings.get('subfolders', {})
+            for extension in settings['extensions']:
+                self.register(extension, category, subfolders.get(extension), settings.get('handler', 'media'))
+        return self
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'r', encoding='utf-8') as file_read:
+            return cls().update(json.load(file_read))
+
+    def known(self, extension: str) -> bool:
+        return extension in self.rules
+
+    def route(self, folder: Path, file_name: Path):  # (target folder, extension, rule) of the file
+        extension = get_extension(file_name.name)
+        rule = self.rules.get(extension, self.default)
+        target_folder = folder / rule.category
+        return (target_folder / rule.subfolder if rule.subfolder else target_folder), extension, rule
+
+    def folders(self) -> tuple:  # sorted folders, they are not scanned again
+        return tuple(dict.fromkeys([rule.category for rule in self.rules.values()] + [self.default.category]))
+
+    def __iter__(self):  # registered extensions in registration order
+        return iter(self.rules)
+
+REGISTRY = ExtensionRegistry().update({
+    'images': {'extensions': ['JPEG', 'JPG', 'PNG', 'SVG']},
+    'audio': {'extensions': ['OGG', 'WAV', 'AMR', 'MP3']},
+    'video': {'extensions': ['MP4', 'AVI', 'MOV', 'MKV']},
+    'documents': {'extensions': ['DOC', 'DOCX', 'TXT', 'PDF', 'XLSX', 'PPTX', 'PY']},
+    'archives': {'extensions': ['ZIP', 'GZ', 'TAR'], 'handler': 'archive'},
+})
+#////////////////end_extension_registry////////////////
+
+#////////////////start_scan_engine////////////////
+SORTED_FOLDERS = REGISTRY.folders()
+SCAN_WORKERS = 8  # threads listing directories, most of the time is spent waiting for I/O
+
+def scan_directory(directory: Path, skip=SORTED_FOLDERS, manifest=None):
+    # one level of the tree, d_type cached by scandir saves a stat per entry.
+    # Directory not changed since the manifest was saved is not listed, file names are None then
+    if manifest is not None:
+        folders = manifest.unchanged(directory)
+        if folders is not None:
+            return directory, folders, None
+    folders, files = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name not in skip:
+                    folders.append(directory / entry.name)
+            elif manifest is None or not manifest.processed(directory, entry):
+                files.append(entry.name)
+    return directory, folders, files
+
+def scan_tree(folder: Path, skip=SORTED_FOLDERS, workers=SCAN_WORKERS, manifest=None):
+    # yield (directory, subfolders, file names) for every directory, breadth first without recursion
+    pending = deque([Path(folder)])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = set()
+        while pending or running:
+            while pending and len(running) < workers * 2:  # bounded quantity of queued listings
+                running.add(executor.submit(scan_directory, pending.popleft(), skip, manifest))
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory, folders, files = future.result()
+                pending.extend(folders)
+                yield directory, folders, files
+#////////////////end_scan_engine////////////////
 
-def clean(folder:Path):
-    #normalize
-    CYRILLIC_SYMBOLS = 'абвгдеєжзіийклмнопрстуфхцчшщьюяєїґ'
-    TRANSLATION = ("a", "b", "v", "h", "d", "e", "ie", "j", "z", "i", "y", "j", "k", "l", "m", "n", "o", "p", "r", "s", "t", "u",
-                "f", "kh", "ts", "ch", "sh", "shch", "", "iy", "ia", "e", "yi", "h")
-    ACCORD = dict()
-    for cyril, latin in zip(CYRILLIC_SYMBOLS, TRANSLATION):
-        ACCORD[ord(cyril)] = latin
-        ACCORD[ord(cyril.upper())] = latin.capitalize()
-
-    def normalize(name: str) -> str:
-        translate_name = re.sub(r'[^\w.]', '_', name.translate(ACCORD))
-        return translate_name
-    #parser
-    JPEG_IMG = []
-    JPG_IMG = []
-    PNG_IMG = []
-    SVG_IMG = []
-    #'MP3', 'OGG', 'WAV', 'AMR'
-    MP3_AUDIO = []
-    OGG_AUDIO = []
-    WAV_AUDIO = []
-    AMR_AUDIO = []
-    #'AVI', 'MP4', 'MOV', 'MKV'
-    MP4_VIDEO = []
-    AVI_VIDEO = []
-    MOV_VIDEO = []
-    MKV_VIDEO = []
-    #'DOC', 'DOCX', 'TXT', 'PDF', 'XLSX', 'PPTX, PY
-    DOC_DOC = []
-    DOCX_DOC = []
-    TXT_DOC = []
-    PDF_DOC = []
-    XLSX_DOC = []
-    PPTX_DOC = []
-    PY_DOC = []
-    #'ZIP', 'GZ', 'TAR'
-    ZIP_ARCH = []
-    GZ_ARCH = []
-    TAR_ARCH = []
-    NOT_DEFINED = []
-
-    REGISTER_EXTENSION = {
-        'JPEG': JPEG_IMG,
-        'JPG': JPG_IMG,
-        'PNG': PNG_IMG,
-        'SVG': SVG_IMG,
-        'OGG': OGG_AUDIO,
-        'WAV': WAV_AUDIO,
-        'AMR': AMR_AUDIO,            
-        'MP3': MP3_AUDIO,
-        'MP4': MP4_VIDEO,
-        'AVI': AVI_VIDEO,
-        'MOV': MOV_VIDEO,
-        'MKV': MKV_VIDEO,
-        'DOC': DOC_DOC,
-        'DOCX': DOCX_DOC,
-        'TXT': TXT_DOC,
-        'PDF': PDF_DOC,
-        'XLSX': XLSX_DOC,
-        'PPTX': PPTX_DOC,
-        'PY': PY_DOC,
-        'ZIP': ZIP_ARCH,
-        'GZ': GZ_ARCH,
-        'TAR': TAR_ARCH
-    }
-
-    FOLDERS = []
-    EXTENSIONS = set()
-    UNKNOWN = set()
-
-    def get_extension(name: str) -> str:
-        return Path(name).suffix[1:].upper()  
-    #folder
-    def scan(folder: Path):
-        for item in folder.iterdir():
-            if item.is_dir(): 
-                if item.name not in ('archives', 'video', 'audio', 'documents', 'images', 'not_defined'):
-                    FOLDERS.append(item)
-                    scan(item)
+#////////////////start_scan_manifest////////////////
+MANIFEST_NAME = '.clean_manifest.json'
+
+# Class keeps mtime and inode of every sorted directory between runs of the cleaner, so a rerun
+# lists only changed directories. Archives stay in place after extraction and are stored as
+# processed entries, so they aren't extracted again
+class ScanManifest:
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        self.filename = self.folder / MANIFEST_NAME
+        self.folders = {}  # relative path -> [mtime_ns, inode, subfolder names, {file: [mtime_ns, size]}]
+        self.listed = set()  # directories listed in this run
+        self.handled = {}  # directory -> names of files left in place by this run
+        try:
+            with open(self.filename, 'r', encoding='utf-8') as file_read:
+                self.folders = json.load(file_read)['folders']
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+    def key(self, directory: Path) -> str:
+        return directory.relative_to(self.folder).as_posix()
+
+    def unchanged(self, directory: Path):  # stored subfolders, None when directory must be listed
+        entry = self.folders.get(self.key(directory))
+        try:
+            stat = os.stat(directory)
+        except FileNotFoundError:  # removed since the last run, dropped from the manifest on save
+            self.listed.add(directory)
+            return []
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_ino:
+            self.listed.add(directory)
+            return None
+        return [directory / name for name in entry[2]]
+
+    def processed(self, directory: Path, entry) -> bool:
+        if directory == self.folder and entry.name == MANIFEST_NAME:
+            return True
+        stored = self.folders.get(self.key(directory))
+        if stored is None or entry.name not in stored[3]:
+            return False
+        stat = entry.stat()
+        return stored[3][entry.name] == [stat.st_mtime_ns, stat.st_size]
+
+    def handle(self, action):  # remember files which stay in place after handling
+        if action.action in ('extracted', 'partial', 'failed', 'duplicate'):
+            self.handled.setdefault(action.source.parent, set()).add(action.source.name)
+
+    def save(self, skip=SORTED_FOLDERS):
+        # file is rewritten in place, creating it would change mtime of the sorted folder
+        self.filename.touch()
+        for directory in self.listed:
+            key = self.key(directory)
+            old_entry = self.folders.pop(key, None)
+            try:
+                stat = os.stat(directory)  # taken before listing, a later arrival changes mtime
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
                 continue
-            extension = get_extension(item.name)  # gex file extention
-            full_name = folder / item.name  # full path to file
-            if not extension:
-                NOT_DEFINED.append(full_name)
-            else:
-                try:
-                    REGISTER_EXTENSION[extension].append(full_name)
-                    EXTENSIONS.add(extension)
-                except KeyError:
-                    UNKNOWN.add(extension) 
-                    NOT_DEFINED.append(full_name)
-
-    def handle_media(file_name: Path, target_folder: Path):
-        target_folder.mkdir(exist_ok=True, parents=True)
-        file_name.replace(target_folder / normalize(file_name.name))
-
-    def handle_archive(file_name: Path, target_folder: Path):
-        target_folder.mkdir(exist_ok=True, parents=True)
-        folder_for_file = target_folder / normalize(file_name.name.replace(file_name.suffix, ''))
-        folder_for_file.mkdir(exist_ok=True, parents=True)
+            folders, files = [], {}
+            for entry in entries:
+                if entry.is_dir():
+                    if entry.name not in skip:
+                        folders.append(entry.name)
+                elif directory != self.folder or entry.name != MANIFEST_NAME:
+                    file_stat = entry.stat()
+                    files[entry.name] = [file_stat.st_mtime_ns, file_stat.st_size]
+            handled = self.handled.get(directory, set())
+            old_files = old_entry[3] if old_entry else {}
+            if all(name in handled or old_files.get(name) == value for name, value in files.items()):
+                self.folders[key] = [stat.st_mtime_ns, stat.st_ino, folders, files]
+            # otherwise new files arrived during the run, directory is listed again next time
+        with open(self.filename, 'w', encoding='utf-8') as file_write:  # broken file means full rescan
+            json.dump({'folders': self.folders}, file_write)
+#////////////////end_scan_manifest////////////////
+
+#////////////////start_dedup////////////////
+CHUNK_SIZE = 1 << 20  # files are hashed by chunks, never read whole
+PARTIAL_SIZE = 1 << 16  # head of the file compared before the full hash
+
+# Class finds byte-identical files among the sorted ones: same size first, then hash of the head,
+# then full hash. Hashes are computed only when sizes match and are cached per path.
+# Duplicate is hard-linked to the stored copy ('link') or left in place ('skip'),
+# different files with the same normalized name get unique suffixes
+class Deduplicator:
+    MODES = ('skip', 'link')
+
+    def __init__(self, mode='skip'):
+        if mode not in self.MODES:
+            raise ValueError(f"Dedup mode should be one of {', '.join(self.MODES)}")
+        self.mode = mode
+        self.by_size = {}  # size -> stored paths
+        self.hashes = {}  # path -> {'partial': digest, 'full': digest}
+        self.reserved = set()  # target names taken in this run
+        self.size_locks = {}
+        self.lock = Lock()
+
+    def digest(self, path: Path, kind):
+        cached = self.hashes.setdefault(path, {})
+        if kind not in cached:
+            hasher = hashlib.blake2b()
+            with open(path, 'rb') as file_read:
+                if kind == 'partial':
+                    hasher.update(file_read.read(PARTIAL_SIZE))
+                else:
+                    for chunk in iter(lambda: file_read.read(CHUNK_SIZE), b''):
+                        hasher.update(chunk)
+            cached[kind] = hasher.digest()
+        return cached[kind]
+
+    def same_content(self, first: Path, second: Path) -> bool:
+        return (self.digest(first, 'partial') == self.digest(second, 'partial')
+                and self.digest(first, 'full') == self.digest(second, 'full'))
+
+    def unique(self, target: Path) -> Path:
+        with self.lock:
+            candidate, number = target, 1
+            while candidate in self.reserved or candidate.exists():
+                candidate = target.with_name(f"{target.stem}_{number}{target.suffix}")
+                number += 1
+            self.reserved.add(candidate)
+        return candidate
+
+    def place(self, file_name: Path, target: Path):  # move file, return (action, stored path)
+        size = file_name.stat().st_size
+        with self.lock:
+            size_lock = self.size_locks.setdefault(size, Lock())
+        with size_lock:  # files of different size never match, they are placed in parallel
+            candidates = list(self.by_size.get(size, ()))
+            if target.is_file() and target.stat().st_size == size:
+                candidates.append(target)  # stored by one of previous runs
+            for stored in candidates:
+                if self.same_content(file_name, stored):
+                    self.hashes.pop(file_name, None)
+                    if self.mode == 'skip':
+                        return 'duplicate', stored
+                    linked = self.unique(target)
+                    try:
+                        os.link(stored, linked)
+                    except OSError:  # other device or no hard links on the file system
+                        file_name.replace(linked)
+                        return 'moved', linked
+                    file_name.unlink()
+                    return 'linked', linked
+            unique_target = self.unique(target)
+            file_name.replace(unique_target)
+            if file_name in self.hashes:
+                self.hashes[unique_target] = self.hashes.pop(file_name)
+            self.by_size.setdefault(size, []).append(unique_target)
+        return 'moved', unique_target
+#////////////////end_dedup////////////////
+
+#////////////////start_extract_engine////////////////
+EXTRACT_MAX_BYTES = 4 << 30  # bytes written per archive, protects from zip bombs
+EXTRACT_MAX_ENTRIES = 100000  # members per archive
+
+class ExtractionLimitError(Exception):
+    pass
+
+def member_path(target: Path, name: str):
+    # normalized path of the member inside target, '..' and absolute parts are dropped
+    parts = [normalize(part) for part in name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    return target.joinpath(*parts) if parts else None
+
+# Class reads archive members one by one and streams each of them straight to its target path.
+# What is written before a broken member or exceeded limit stays in the target folder
+class ArchiveExtractor:
+    def __init__(self, target: Path, max_bytes=EXTRACT_MAX_BYTES, max_entries=EXTRACT_MAX_ENTRIES):
+        self.target = Path(target)
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.bytes = 0
+        self.entries = 0
+
+    def member(self, name: str, open_member=None):  # open_member is None for directories
+        self.entries += 1
+        if self.entries > self.max_entries:
+            raise ExtractionLimitError(f"Archive has more than {self.max_entries} entries")
+        path = member_path(self.target, name)
+        if path is None:
+            return
+        if open_member is None:
+            path.mkdir(exist_ok=True, parents=True)
+            return
+        path.parent.mkdir(exist_ok=True, parents=True)
+        with open_member() as source, open(path, 'wb') as file_write:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                self.bytes += len(chunk)
+                if self.bytes > self.max_bytes:
+                    raise ExtractionLimitError(f"Archive expands to more than {self.max_bytes} bytes")
+                file_write.write(chunk)
+
+    def extract_zip(self, archive: Path):
+        with zipfile.ZipFile(archive) as zip_file:
+            for info in zip_file.infolist():
+                self.member(info.filename, None if info.is_dir() else lambda: zip_file.open(info))
+
+    def extract_tar(self, archive: Path):  # stream mode, members are read in order without seeking
+        with tarfile.open(archive, 'r|*') as tar_file:
+            for member in tar_file:
+                if member.isdir():
+                    self.member(member.name)
+                elif member.isfile():  # links and devices are skipped
+                    self.member(member.name, lambda: tar_file.extractfile(member))
+
+    def extract_gzip(self, archive: Path):  # single compressed file
+        self.member(archive.stem, lambda: gzip.open(archive))
+
+    def extract(self, archive: Path):
+        archive = Path(archive)
+        if zipfile.is_zipfile(archive):
+            return self.extract_zip(archive)
+        try:
+            return self.extract_tar(archive)
+        except tarfile.ReadError:
+            if self.entries:
+                raise
+        with open(archive, 'rb') as file_read:
+            is_gzip = file_read.read(2) == b'\x1f\x8b'
+        if not is_gzip:
+            raise shutil.ReadError(f"{archive.name} is not a zip, tar or gzip archive")
+        self.extract_gzip(archive)
+
+def extract_archive(archive: str, target: str, max_bytes=EXTRACT_MAX_BYTES, max_entries=EXTRACT_MAX_ENTRIES):
+    # runs in the extraction process pool, returns (entries, bytes) written
+    extractor = ArchiveExtractor(target, max_bytes, max_entries)
+    extractor.extract(archive)
+    return extractor.entries, extractor.bytes
+#////////////////end_extract_engine////////////////
+
+#////////////////start_move_pipeline////////////////
+MOVE_WORKERS = 8  # threads moving files
+QUEUE_SIZE = 1024  # files waiting for a worker and actions waiting for the caller
+EXTRACT_WORKERS = os.cpu_count() or 1  # processes unpacking archives
+# the pool is started from a worker thread, forking a process with running threads may deadlock
+EXTRACT_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Result of one handled file: 'moved', 'extracted', 'partial' (extraction stopped by a limit or
+# broken member, written part is kept), 'failed' (not an archive, left in place),
+# 'linked' or 'duplicate' (left in place) when duplicates are searched,
+# 'missing' when a planned file is gone before the plan runs
+FileAction = namedtuple('FileAction', 'action source target extension category')
+
+# Class creates every target folder once per run
+class TargetFolders:
+    def __init__(self):
+        self.created = set()
+        self.lock = Lock()
+
+    def get(self, folder: Path) -> Path:
+        if folder not in self.created:
+            with self.lock:
+                if folder not in self.created:
+                    folder.mkdir(exist_ok=True, parents=True)
+                    self.created.add(folder)
+        return folder
+
+def handle_media(pipeline, file_name: Path, target_folder: Path, extension, category):
+    target = pipeline.targets.get(target_folder) / normalize(file_name.name)
+    if pipeline.dedup is not None:
+        action, target = pipeline.dedup.place(file_name, target)
+        return pipeline.done(FileAction(action, file_name, target, extension, category))
+    file_name.replace(target)
+    pipeline.done(FileAction('moved', file_name, target, extension, category))
+
+def archive_folder_name(file_name: Path) -> str:
+    return normalize(file_name.name.replace(file_name.suffix, ''))
+
+def handle_archive(pipeline, file_name: Path, target_folder: Path, extension, category):
+    folder_for_file = pipeline.targets.get(target_folder) / archive_folder_name(file_name)
+    folder_for_file.mkdir(exist_ok=True, parents=True)
+    pipeline.extract(file_name, folder_for_file, extension, category)
+
+HANDLERS = {'media': handle_media, 'archive': handle_archive}
+
+# Class scans the folder on its own thread and runs handlers of scanned files on worker
+# threads, archives are unpacked in a process pool. Handled files come out of results queue
+class CleanPipeline:
+    def __init__(self, workers=MOVE_WORKERS, queue_size=QUEUE_SIZE, extract_workers=EXTRACT_WORKERS, manifest=None, dedup=None,
+                 max_bytes=EXTRACT_MAX_BYTES, max_entries=EXTRACT_MAX_ENTRIES, registry=REGISTRY):
+        self.jobs = Queue(maxsize=queue_size)
+        self.results = Queue(maxsize=queue_size)  # FileAction, None after the last one
+        self.targets = TargetFolders()
+        self.registry = registry  # routes scanned files
+        self.folders = []  # listed subfolders, removed after the run when they are empty
+        self.manifest = manifest  # ScanManifest of incremental run
+        self.dedup = dedup  # Deduplicator when duplicates are searched
+        self.extract_workers = extract_workers
+        self.max_bytes = max_bytes  # limits of every extracted archive
+        self.max_entries = max_entries
+        self.process_pool = None  # started with the first archive
+        self.errors = []
+        self.cancelled = False
+        self.lock = Lock()
+        self.threads = [Thread(target=self.work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, folder: Path):
+        try:
+            for directory, folders, files in scan_tree(folder, self.registry.folders(), manifest=self.manifest):
+                if self.cancelled:
+                    break
+                if files is None:  # not changed since the last incremental run
+                    continue
+                if directory != folder:
+                    self.folders.append(directory)
+                for name in files:
+                    self.dispatch(folder, directory / name)
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            self.close()
+            self.results.put(None)
+
+    def run_plan(self, plan):  # jobs go grouped by target folder, each folder is created once
         try:
-            shutil.unpack_archive(str(file_name.absolute()), str(folder_for_file.absolute()))
-        except shutil.ReadError:
-            folder_for_file.rmdir()
-            return file_name.unlink()
-
-    def main_cleaner(folder: Path):
-        scan(folder)
-        for file in JPEG_IMG:
-            handle_media(file, folder / 'images' / 'JPEG')
-        for file in JPG_IMG:
-            handle_media(file, folder / 'images' / 'JPG')
-        for file in PNG_IMG:
-            handle_media(file, folder / 'images' / 'PNG')
-        for file in SVG_IMG:
-            handle_media(file, folder / 'images' / 'SVG')
-
-        for file in MP3_AUDIO:
-            handle_media(file, folder / 'audio' / 'MP3')
-        for file in OGG_AUDIO:
-            handle_media(file, folder / 'audio' / 'OGG')
-        for file in WAV_AUDIO:
-            handle_media(file, folder / 'audio' / 'WAV')  
-        for file in AMR_AUDIO:
-            handle_media(file, folder / 'audio' / 'AMR')  
-
-        for file in AVI_VIDEO:
-            handle_media(file, folder / 'video' / 'AVI')
-        for file in MP4_VIDEO:
-            handle_media(file, folder / 'video' / 'MP4')
-        for file in MOV_VIDEO:
-            handle_media(file, folder / 'video' / 'MOV')                                    
-        for file in MKV_VIDEO:
-            handle_media(file, folder / 'video' / 'MKV')
-
-        for file in DOC_DOC:
-            handle_media(file, folder / 'documents' / 'DOC')
-        for file in DOCX_DOC:
-            handle_media(file, folder / 'documents' / 'DOCX')        
-        for file in TXT_DOC:
-            handle_media(file, folder / 'documents' / 'TXT')        
-        for file in PDF_DOC:
-            handle_media(file, folder / 'documents' / 'PDF')        
-        for file in XLSX_DOC:
-            handle_media(file, folder / 'documents' / 'XLSX') 
-        for file in PPTX_DOC:
-            handle_media(file, folder / 'documents' / 'PPTX')               
-        for file in PY_DOC:
-            handle_media(file, folder / 'documents' / 'PY')        
-
-        for file in NOT_DEFINED:
-            handle_media(file, folder / 'not_defined')
-
-        for file in ZIP_ARCH:
-            handle_archive(file, folder / 'archives' / 'ZIP')
-        for file in GZ_ARCH:
-            handle_archive(file, folder / 'archives' / 'GZ') 
-        for file in TAR_ARCH:
-            handle_archive(file, folder / 'archives' / 'TAR')               
-
-        for folder in FOLDERS[::-1]: #delete empty folders
+            self.folders.extend(plan.folders)
+            for target_folder, files in plan.moves.items():
+                for file_name, extension, rule in files:
+                    if self.cancelled:
+                        return
+                    if not file_name.exists():  # removed or moved since the plan was made
+                        self.done(FileAction('missing', file_name, None, extension, rule.category))
+                        continue
+                    self.jobs.put((HANDLERS[rule.handler], file_name, target_folder, extension, rule.category))
+        except Exception as error:
+            self.errors.append(error)
+        finally:
+            self.close()
+            self.results.put(None)
+
+    def dispatch(self, folder: Path, file_name: Path):
+        target_folder, extension, rule = self.registry.route(folder, file_name)
+        self.jobs.put((HANDLERS[rule.handler], file_name, target_folder, extension, rule.category))
+
+    def work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            if self.cancelled:
+                continue
+            handler, *arguments = job
             try:
-                folder.rmdir()
+                handler(self, *arguments)
+            except Exception as error:
+                self.errors.append(error)
+
+    def done(self, action):
+        if self.manifest is not None:
+            self.manifest.handle(action)
+        self.results.put(action)
+
+    def extract(self, file_name: Path, folder_for_file: Path, extension, category):
+        with self.lock:
+            if self.process_pool is None:
+                self.process_pool = ProcessPoolExecutor(
+                    max_workers=self.extract_workers, mp_context=multiprocessing.get_context(EXTRACT_START_METHOD))
+            future = self.process_pool.submit(
+                extract_archive, str(file_name.absolute()), str(folder_for_file.absolute()),
+                self.max_bytes, self.max_entries)
+        future.add_done_callback(lambda future: self.extracted(future, file_name, folder_for_file, extension, category))
+
+    def extracted(self, future, file_name: Path, folder_for_file: Path, extension, category):
+        try:
+            future.result()
+            action = 'extracted'
+        except shutil.ReadError:  # not an archive, it stays in place
+            try:
+                folder_for_file.rmdir()
             except OSError:
-                print(f'Error during remove folder {folder}')
-        return REGISTER_EXTENSION, UNKNOWN
-       
+                pass
+            action, folder_for_file = 'failed', None
+        except Exception:  # limit or broken member, extracted part is kept for recovery
+            action = 'partial'
+        self.done(FileAction(action, file_name, folder_for_file, extension, category))
+
+    def cancel(self):
+        self.cancelled = True
+
+    def close(self):  # wait for every job and archive
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+#////////////////end_move_pipeline////////////////
+
+#////////////////start_clean_plan////////////////
+# Plan of clean() built without touching the disk: moves grouped by target folder,
+# bytes per category, archive expansion estimates and names taken twice
+class CleanPlan:
+    def __init__(self, folder: Path, registry=REGISTRY):
+        self.folder = Path(folder)
+        self.registry = registry
+        self.moves = {}  # target folder -> [(source, extension, ExtensionRule)]
+        self.bytes = {}  # category -> bytes of sorted files
+        self.archives = {}  # archive -> (entries, expanded bytes), None when it can't be estimated
+        self.collisions = []  # (source, destination) which would overwrite another file
+        self.folders = []  # scanned subfolders, removed after execution when they are empty
+        self.destinations = set()
+
+    def add(self, file_name: Path, size: int):
+        target_folder, extension, rule = self.registry.route(self.folder, file_name)
+        self.moves.setdefault(target_folder, []).append((file_name, extension, rule))
+        self.bytes[rule.category] = self.bytes.get(rule.category, 0) + size
+        destination = self.destination(file_name, target_folder, rule)
+        if rule.handler == 'archive':
+            self.archives[file_name] = estimate_archive(file_name)
+        else:
+            if destination in self.destinations or destination.exists():
+                self.collisions.append((file_name, destination))
+        self.destinations.add(destination)
+
+    def destination(self, file_name: Path, target_folder: Path, rule) -> Path:
+        name = archive_folder_name(file_name) if rule.handler == 'archive' else normalize(file_name.name)
+        return target_folder / name
+
+    def __iter__(self):  # (source, destination) in execution order
+        for target_folder, files in self.moves.items():
+            for file_name, extension, rule in files:
+                yield file_name, self.destination(file_name, target_folder, rule)
+
+    def __len__(self):
+        return sum(len(files) for files in self.moves.values())
+
+def estimate_archive(file_name: Path):  # (entries, expanded bytes) read from archive headers only
+    try:
+        if zipfile.is_zipfile(file_name):
+            with zipfile.ZipFile(file_name) as zip_file:
+                infos = zip_file.infolist()
+                return len(infos), sum(info.file_size for info in infos)
+        with open(file_name, 'rb') as file_read:
+            is_gzip = file_read.read(2) == b'\x1f\x8b'
+            if is_gzip:  # size of the content modulo 4 GiB is stored at the end, members are unknown
+                file_read.seek(-4, os.SEEK_END)
+                return None, int.from_bytes(file_read.read(4), 'little')
+        with tarfile.open(file_name, 'r:') as tar_file:  # plain tar, headers are read with seeks
+            members = tar_file.getmembers()
+            return len(members), sum(member.size for member in members)
+    except (OSError, zipfile.BadZipFile, tarfile.TarError):
+        return None
+
+def plan_clean(folder: Path, manifest=None, registry=REGISTRY) -> CleanPlan:
+    folder = Path(folder)
+    plan = CleanPlan(folder, registry)
+    for directory, folders, files in scan_tree(folder, registry.folders(), manifest=manifest):
+        if files is None:
+            continue
+        if directory != folder:
+            plan.folders.append(directory)
+        for name in files:
+            file_name = directory / name
+            plan.add(file_name, file_name.stat().st_size)
+    del plan.destinations  # needed only while the plan is built
+    return plan
+#////////////////end_clean_plan////////////////
+
+#////////////////start_clean_function////////////////
+def run_pipeline(pipeline, producer, source):
+    # yield results of the pipeline fed by producer(source) on its own thread
+    producer = Thread(target=producer, args=(source,), daemon=True)
+    producer.start()
+    finished = False
+    try:
+        while True:
+            action = pipeline.results.get()
+            if action is None:
+                break
+            yield action
+        finished = True
+    finally:
+        if not finished:  # caller stopped early, let the pipeline skip the rest
+            pipeline.cancel()
+            while pipeline.results.get() is not None:
+                pass
+        producer.join()
+    if pipeline.errors:
+        raise pipeline.errors[0]
+    for folder in sorted(pipeline.folders, key=lambda item: len(item.parts), reverse=True): #delete empty folders, deepest first
+        try:
+            folder.rmdir()
+        except OSError:
+            print(f'Error during remove folder {folder}')
+
+def iter_clean(folder: Path, incremental=False, dedup=None, registry=REGISTRY, **pipeline_options):
+    # yield FileAction for every handled file while the folder is still being sorted.
+    # Incremental run skips directories not changed since the previous incremental run,
+    # dedup 'skip' or 'link' turns on the search of byte-identical files,
+    # registry routes files by extension,
+    # pipeline_options are passed to CleanPipeline, e.g. max_bytes and max_entries of archives
+    manifest = ScanManifest(folder) if incremental else None
+    pipeline = CleanPipeline(manifest=manifest, dedup=Deduplicator(dedup) if dedup else None,
+                             registry=registry, **pipeline_options)
+    yield from run_pipeline(pipeline, pipeline.run, Path(folder))
+    if manifest is not None:
+        manifest.save(registry.folders())
+
+def iter_plan(plan: CleanPlan, dedup=None, **pipeline_options):
+    # yield FileAction for every file of the plan made by clean(folder, plan_only=True)
+    pipeline = CleanPipeline(dedup=Deduplicator(dedup) if dedup else None, registry=plan.registry, **pipeline_options)
+    yield from run_pipeline(pipeline, pipeline.run_plan, plan)
+
+def summarize(actions, registry=REGISTRY):  # sorted files grouped by extension and set of unknown extensions
+    register = {}
+    unknown = set()
+    for action in actions:
+        if action.action == 'missing':
+            continue
+        if registry.known(action.extension):
+            register.setdefault(action.extension, []).append(action.source)
+        elif action.extension:
+            unknown.add(action.extension)
+    return {extension: register[extension] for extension in registry if extension in register}, unknown
+
+def execute_plan(plan: CleanPlan, dedup=None, **pipeline_options):
+    return summarize(iter_plan(plan, dedup, **pipeline_options), plan.registry)
+
+def clean(folder:Path, incremental=False, dedup=None, plan_only=False, registry=REGISTRY, **pipeline_options):
+    # plan_only returns CleanPlan for execute_plan() instead of sorting the folder,
+    # registry is ExtensionRegistry, e.g. loaded with ExtensionRegistry.load(config)
     if folder:
-        folder_path = Path(folder)
-        exstention, unknown = main_cleaner(folder_path)
-        return  {key: value for key, value in exstention.items() if value}, unknown 
-#/////////////End_clean_function/////////////
\ No newline at end of file
+        if plan_only:
+            return plan_clean(folder, ScanManifest(folder) if incremental else None, registry)
+        return summarize(iter_clean(folder, incremental, dedup, registry, **pipeline_options), registry)
+#/////////////End_clean_function/////////////
+
+if __name__ == '__main__':
+    for title, microseconds in benchmark_normalize().items():
+        print(f"{title} normalize: {microseconds:.2f} us per file")
@@ -0,0 +1,100 @@
+from import_part import COLUMNS, PHONE_SEPARATOR, open_text
+import csv
+import json
+
+BUFFER_SIZE = 1 << 20  # bytes collected before a write to the file
+VCARD_LINE_LENGTH = 75  # longer vCard lines are folded
+
+# Generators of exported lines, one record is formatted at a time
+def record_row(record):  # row with the importer columns, so exported files can be imported back
+    birthday = record.birthday.value if record.birthday else None
+    return {
+        'name': record.name.value,
+        'phones': [phone.value for phone in record.phones],
+        'birthday': birthday.isoformat() if birthday else None,
+        'email': record.email.value if record.email else None,
+        'address': record.address.value if record.address else None,
+        'notes': [note.value for note in record.notes],
+    }
+
+def iter_jsonl(records):
+    for record in records:
+        yield json.dumps(record_row(record), ensure_ascii=False)
+        yield '\n'
+
+def vcard_escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace(',', '\\,').replace(';', '\\;')
+
+def vcard_line(line):  # fold to lines of VCARD_LINE_LENGTH UTF-8 octets, continuation starts with space
+    if len(line.encode('utf-8')) <= VCARD_LINE_LENGTH:
+        return f"{line}\r\n"
+    parts = []
+    start = size = 0
+    limit = VCARD_LINE_LENGTH
+    for position, char in enumerate(line):
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:  # multi-byte characters are never split between lines
+            parts.append(line[start:position])
+            start, size, limit = position, 0, VCARD_LINE_LENGTH - 1
+        size += char_size
+    parts.append(line[start:])
+    return '\r\n '.join(parts) + '\r\n'
+
+def iter_vcard(records):  # vCard 3.0
+    for record in records:
+        row = record_row(record)
+        yield 'BEGIN:VCARD\r\nVERSION:3.0\r\n'
+        yield vcard_line(f"FN:{vcard_escape(row['name'])}")
+        yield vcard_line(f"N:{vcard_escape(row['name'])};;;;")
+        for phone in row['phones']:
+            yield vcard_line(f"TEL;TYPE=CELL:{phone}")
+        if row['email']:
+            yield vcard_line(f"EMAIL;TYPE=INTERNET:{vcard_escape(row['email'])}")
+        if row['birthday']:
+            yield vcard_line(f"BDAY:{row['birthday']}")
+        if row['address']:
+            yield vcard_line(f"ADR:;;{vcard_escape(row['address'])};;;;")
+        for note in row['notes']:
+            yield vcard_line(f"NOTE:{vcard_escape(note)}")
+        yield 'END:VCARD\r\n'
+
+# Writers stream records to an open text file
+def write_csv(records, file_write):
+    writer = csv.writer(file_write)
+    writer.writerow(COLUMNS)
+    for record in records:
+        row = record_row(record)
+        row['phones'] = PHONE_SEPARATOR.join(row['phones'])
+        row['notes'] = '\n'.join(row['notes'])
+        writer.writerow(['' if row[column] is None else row[column] for column in COLUMNS])
+
+def write_jsonl(records, file_write):
+    file_write.writelines(iter_jsonl(records))
+
+def write_vcard(records, file_write):
+    file_write.writelines(iter_vcard(records))
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'vcf': write_vcard}
+
+def export_format(filename):  # writer name by extension, ".gz" is skipped
+    name = str(filename).lower().removesuffix('.gz')
+    for format, extensions in (('csv', ('.csv',)), ('jsonl', ('.jsonl', '.ndjson')), ('vcf', ('.vcf', '.vcard'))):
+        if name.endswith(extensions):
+            return format
+    raise ValueError(f"Unknown format of {filename}, expected .csv, .jsonl or .vcf")
+
+# Export every contact of the book in the book order, ".gz" filename is compressed.
+# Records are read one at a time, so memory doesn't depend on the book size
+def export_contacts(book, filename, format=None):
+    format = format or export_format(filename)
+    exported = 0
+
+    def records():
+        nonlocal exported
+        for record in book.iter_records():
+            exported += 1
+            yield record
+
+    with open_text(filename, 'w', BUFFER_SIZE) as file_write:
+        WRITERS[format](records(), file_write)
+    return exported
@@ -1,10 +1,14 @@
 
-from datetime import datetime
+from datetime import datetime, date
 from abc import abstractmethod, ABC
+from functools import lru_cache
 import re
+import sys
 
 # Abstraction for user classes
 class UserClassAbstraction(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def __init__(self, value=None):
         self.value = value
@@ -19,18 +23,76 @@ class UserClassAbstraction(ABC):
         return f"{self.__class__.__name__}({self.value})"
 
 
-# Parrent class for all fields
+NAME_INVALID_SYMBOL = re.compile(r'[^a-zA-Z\s]')
+PHONE_PATTERN_UA = re.compile(r"^0[3456789]\d{8}$")
+TAG_PATTERN = re.compile(r'#(\w+)')
+EMAIL_PATTERN = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+INVALID = object()  # returned by converters instead of raising on invalid value
+
+# Repeated strings (addresses, notes with tags) share one object between records
+def intern_value(value):
+    return sys.intern(value) if type(value) is str else value
+
+# Equal birthdays share one date object, "YYYY-MM-DD" is parsed without strptime
+@lru_cache(maxsize=1 << 16)
+def parse_date(value: str):
+    if len(value) == 10 and value[4] == value[7] == '-' and value.isascii() \
+            and value[:4].isdigit() and value[5:7].isdigit() and value[8:].isdigit():
+        return date(int(value[:4]), int(value[5:7]), int(value[8:]))
+    return datetime.strptime(value, '%Y-%m-%d').date()  # other forms accepted by the format, e.g. "1990-1-5"
+
+# Converters return the value to store or INVALID
+def convert_name(value):
+    return value if isinstance(value, str) and not NAME_INVALID_SYMBOL.search(value) else INVALID
+
+def convert_phone(value):
+    return value if isinstance(value, str) and PHONE_PATTERN_UA.match(value) else INVALID
+
+def convert_email(value):
+    return value if isinstance(value, str) and EMAIL_PATTERN.match(value) else INVALID
+
+def convert_text(value):  # any string, repeated ones are interned
+    return intern_value(value) if value is None or isinstance(value, str) else INVALID
+
+def convert_date(value):
+    if not value:
+        return None
+    try:
+        return parse_date(value)
+    except Exception:
+        return INVALID
+
+# Parrent class for all fields, slots keep a field to a single value reference
 class Field(UserClassAbstraction):
+    __slots__ = ('__value',)
+    convert = staticmethod(lambda value: value)
+    error = None  # message of ValueError raised for INVALID value
+
     def __init__(self, value=None):
         self.__value = None
         self.value = value
 
+    @classmethod
+    def from_valid(cls, value):  # field of a value already converted, e.g. by validate_batch
+        field = cls.__new__(cls)
+        field.__value = value
+        return field
+
+    def __getstate__(self):
+        return (self.__value,)
+
+    def __setstate__(self, state):  # files saved before slots hold {'_Field__value': value}
+        self.__value = state['_Field__value'] if isinstance(state, dict) else state[0]
+
     @property
     def value(self):
         return self.__value
 
     @value.setter
     def value(self, value):
+        value = self.convert(value)
+        if value is INVALID:
+            raise ValueError(self.error)
         self.__value = value
 
     def __repr__(self):
@@ -38,56 +100,67 @@ class Field(UserClassAbstraction):
 
 # Class for contact name, allow letters and space characters
 class Name(Field):
-    @Field.value.setter
-    def value(self, value: str):
-        if not re.findall(r'[^a-zA-Z\s]', value):
-            self._Field__value = value
-        else:
-            raise ValueError('Name should include only letter characters')
+    __slots__ = ()
+    convert = staticmethod(convert_name)
+    error = 'Name should include only letter characters'
 
 # Class for contact birthday date  allow "YYYY-MM-DD" format
 class Birthday(Field):
+    __slots__ = ()
+    convert = staticmethod(convert_date)
+    error = "Date should be in the format YYYY-MM-DD"
+
     @Field.value.setter
     def value(self, value=None):
         if value:
-            try:
-                self._Field__value = datetime.strptime(value, '%Y-%m-%d').date()
-            except Exception:
-                raise ValueError("Date should be in the format YYYY-MM-DD")
+            Field.value.fset(self, value)
 
 # Class for contact phone with checking according UA providers
 class Phone(Field):
-    @Field.value.setter
-    def value(self, value):
-        phone_pattern_ua = re.compile(r"^0[3456789]\d{8}$")
-        if phone_pattern_ua.match(value):
-            self._Field__value = value
-        else:
-            raise ValueError('Phone is not valid')
+    __slots__ = ()
+    convert = staticmethod(convert_phone)
+    error = 'Phone is not valid'
 
 # Class for contact email, allow format for more common email addresses
 class Email(Field):
-    @Field.value.setter
-    def value(self, value):
-        email_pattern = re.compile(
-            "^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
-        if email_pattern.match(value):
-            self._Field__value = value
-        else:
-            raise ValueError("Email is not valid")
+    __slots__ = ()
+    convert = staticmethod(convert_email)
+    error = "Email is not valid"
 
 # Class for contact address, allow any string
 class Address(Field):
-    @Field.value.setter
-    def value(self, value):
-        self._Field__value = value
+    __slots__ = ()
+    convert = staticmethod(convert_text)
+    error = 'Address should be a string'
 
-# Class for contact notes, any string
+# Class for contact notes, any string, "#word" fragments are tags of the note
 class Note(Field):
+    __slots__ = ('_tags',)
+    convert = staticmethod(convert_text)
+    error = 'Note should be a string'
+
     @Field.value.setter
     def value(self, value):
-        self._Field__value = value
-
-
-
+        Field.value.fset(self, value)
+        self._tags = None  # parsed on request
 
+    @property
+    def tags(self):  # tags in order of the text, parsed once per value
+        tags = getattr(self, '_tags', None)
+        if tags is None:
+            tags = self._tags = tuple(intern_value(tag) for tag in TAG_PATTERN.findall(self.value or ''))
+        return tags
+
+# Validate many values at once, e.g. imported column: (stored values, {position: error message}),
+# invalid values are stored as None
+def validate_batch(field_cls, values):
+    convert = field_cls.convert
+    results = []
+    errors = {}
+    for position, value in enumerate(values):
+        value = convert(value)
+        if value is INVALID:
+            errors[position] = field_cls.error
+            value = None
+        results.append(value)
+    return results, errors
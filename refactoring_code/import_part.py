@@ -0,0 +1,157 @@
+from record_part import Record
+from fields_part import Name, Birthday, Phone, Email, Address, Note, validate_batch
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from itertools import islice
+import csv
+import gzip
+import json
+import os
+
+# Columns of imported files, "phones" holds numbers separated by ";" and "notes" one note per line in CSV,
+# JSON Lines objects have the same keys, phones and notes may also be lists there
+COLUMNS = ('name', 'phones', 'birthday', 'email', 'address', 'notes')
+PHONE_SEPARATOR = ';'
+CHUNK_SIZE = 10000  # rows validated by one worker task
+IMPORT_WORKERS = os.cpu_count() or 1  # processes validating chunks
+
+def open_text(filename, mode='r', buffering=-1):  # ".gz" files are compressed
+    if str(filename).endswith('.gz'):
+        return gzip.open(filename, f'{mode}t', encoding='utf-8', newline='')
+    return open(filename, mode, buffering, encoding='utf-8', newline='')
+
+def file_format(filename):  # 'csv' or 'jsonl' by extension, ".gz" is skipped
+    name = str(filename).lower().removesuffix('.gz')
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    raise ValueError(f"Unknown format of {filename}, expected .csv or .jsonl")
+
+def read_rows(file_read, format):  # yield (line number, row dict or None, error of unreadable row)
+    if format == 'csv':
+        reader = csv.DictReader(file_read)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    for line_number, line in enumerate(file_read, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if isinstance(row, dict):
+            yield line_number, row, None
+        else:
+            yield line_number, None, "Row should be a JSON object"
+
+def split_values(value, separator):  # non empty strings from a list or a joined string, None if there are others
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(separator)
+    elif not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        return None
+    return [item.strip() for item in value if item.strip()]
+
+# Worker task: validate chunk of (line number, row) column by column and build records of valid rows.
+# Returns (records, rejected) where rejected holds (line number, row, {column: error})
+def build_records(chunk):
+    rows = [row for line_number, row in chunk]
+    errors = [{} for row in rows]
+    columns = {}
+    for column, field_cls in (('name', Name), ('birthday', Birthday), ('email', Email)):
+        values, column_errors = validate_batch(field_cls, [row.get(column) or None for row in rows])
+        columns[column] = values
+        for position, error in column_errors.items():
+            errors[position][column] = error
+    addresses, address_errors = validate_batch(Address, [row.get('address') or None for row in rows])
+    for position, error in address_errors.items():
+        errors[position]['address'] = error
+    phone_lists = [split_values(row.get('phones'), PHONE_SEPARATOR) for row in rows]
+    note_lists = [split_values(row.get('notes'), '\n') for row in rows]
+    for position, (phones, notes) in enumerate(zip(phone_lists, note_lists)):
+        if phones is None:
+            errors[position]['phones'] = "Phones should be a string or a list of strings"
+            phone_lists[position] = []
+        if notes is None:
+            errors[position]['notes'] = "Notes should be a string or a list of strings"
+    owners = [position for position, phones in enumerate(phone_lists) for phone in phones]
+    phones, phone_errors = validate_batch(Phone, [phone for phones in phone_lists for phone in phones])
+    for position, error in phone_errors.items():
+        errors[owners[position]]['phones'] = error
+    phone_values = iter(phones)
+
+    records = []
+    rejected = []
+    for position, (line_number, row) in enumerate(chunk):
+        record_phones = [Phone.from_valid(phone) for phone in islice(phone_values, len(phone_lists[position]))]
+        if errors[position]:
+            rejected.append((line_number, row, errors[position]))
+            continue
+        records.append(Record.from_fields(
+            Name.from_valid(columns['name'][position]), record_phones,
+            Birthday.from_valid(columns['birthday'][position]), Email.from_valid(columns['email'][position]),
+            [Note(note) for note in note_lists[position]], Address.from_valid(addresses[position])))
+    return records, rejected
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+# Class import contacts from CSV or JSON Lines file into the address book by chunks.
+# Chunks are validated in worker processes, rejected rows are written to errors file as JSON Lines
+class ContactImporter:
+    def __init__(self, book, chunk_size=CHUNK_SIZE, workers=IMPORT_WORKERS):
+        self.book = book
+        self.chunk_size = chunk_size
+        self.workers = workers  # 0 validates in the calling process
+        self.imported = 0
+        self.rejected = 0
+
+    def run(self, filename, errors_filename=None, format=None):  # (imported, rejected) quantities
+        format = format or file_format(filename)
+        errors_filename = errors_filename or f"{filename}.errors.jsonl"
+        with open_text(filename) as file_read, open(errors_filename, 'w', encoding='utf-8') as errors_file:
+            self.errors_file = errors_file
+            for records, rejected in self.results(self.valid_rows(read_rows(file_read, format))):
+                if records:
+                    self.book.add_records(records)
+                self.imported += len(records)
+                self.reject(rejected)
+        if not self.rejected:
+            os.remove(errors_filename)
+        return self.imported, self.rejected
+
+    def valid_rows(self, rows):  # unreadable rows are rejected at once, others go to workers
+        for line_number, row, error in rows:
+            if row is None:
+                self.reject([(line_number, None, {'row': error})])
+            else:
+                yield line_number, row
+
+    def results(self, rows):  # results of chunks in file order, a few chunks are in flight at once
+        if not self.workers:
+            yield from map(build_records, chunks(rows, self.chunk_size))
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            pending = deque()
+            for chunk in chunks(rows, self.chunk_size):
+                pending.append(pool.submit(build_records, chunk))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def reject(self, rejected):
+        for line_number, row, errors in rejected:
+            self.errors_file.write(json.dumps({'line': line_number, 'row': row, 'errors': errors}, ensure_ascii=False))
+            self.errors_file.write('\n')
+        self.rejected += len(rejected)
+
+def import_contacts(book, filename, errors_filename=None, format=None, **importer_options):
+    # errors file is removed when every row is imported
+    return ContactImporter(book, **importer_options).run(filename, errors_filename, format)
@@ -0,0 +1,445 @@
+from cleaner import TRANSLATE_TABLE
+from abc import abstractmethod, ABC
+from collections import defaultdict
+from datetime import timedelta
+from operator import itemgetter
+import bisect
+import heapq
+import math
+import pickle
+import re
+
+# Abstraction for AddressBook indexes, every index is updated on each mutation
+class IndexAbstraction(ABC):
+    uses_record = True  # False if add() needs only the key, then the index is built without decoding records
+
+    @abstractmethod
+    def add(self, key, record):
+        pass
+    def extend(self, items):  # bulk add of (key, record)
+        for key, record in items:
+            self.add(key, record)
+    @abstractmethod
+    def remove(self, key):
+        pass
+    @abstractmethod
+    def clear(self):
+        pass
+
+# Inverted n-gram index over searchable text (name, phones, notes) of records
+class NGramIndex(IndexAbstraction):
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        self.postings = defaultdict(set)  # gram -> keys of records containing it
+        self.grams_by_key = {}  # key -> grams stored for the record, used on removal
+
+    @staticmethod
+    def record_texts(record):
+        yield record.name.value.lower()
+        for phone in record.phones:
+            yield phone.value
+        for note in record.notes:
+            if note.value:
+                yield note.value.lower()
+
+    def grams(self, text, sizes=None):
+        sizes = sizes or range(1, self.GRAM_SIZE + 1)
+        for size in sizes:
+            for i in range(len(text) - size + 1):
+                yield text[i:i + size]
+
+    def add(self, key, record):
+        grams = set()
+        for text in self.record_texts(record):
+            grams.update(self.grams(text))
+        for gram in grams:
+            self.postings[gram].add(key)
+        self.grams_by_key[key] = grams
+
+    def remove(self, key):
+        for gram in self.grams_by_key.pop(key, ()):
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def clear(self):
+        self.postings.clear()
+        self.grams_by_key.clear()
+
+    def candidates(self, query):  # keys which may contain query, None means all keys
+        if not query:
+            return None
+        size = min(len(query), self.GRAM_SIZE)
+        posting_sets = []
+        for gram in set(self.grams(query, (size,))):
+            keys = self.postings.get(gram)
+            if not keys:
+                return set()
+            posting_sets.append(keys)
+        posting_sets.sort(key=len)
+        return set(posting_sets[0]).intersection(*posting_sets[1:])
+
+# Node of the phone trie, keeps owners of every number passing through it
+class PhoneTrieNode:
+    __slots__ = ('children', 'keys', 'owners')
+
+    def __init__(self):
+        self.children = {}
+        self.keys = {}  # key -> quantity of record phones under this prefix
+        self.owners = set()  # keys of records owning the number ending here
+
+# Prefix trie over Phone values, lookups cost O(len(query))
+class PhoneTrieIndex(IndexAbstraction):
+    def __init__(self):
+        self.root = PhoneTrieNode()
+        self.phones_by_key = {}  # key -> phones stored for the record, used on removal
+
+    def add(self, key, record):
+        phones = [phone.value for phone in record.phones]
+        for phone in phones:
+            node = self.root
+            node.keys[key] = node.keys.get(key, 0) + 1
+            for digit in phone:
+                node = node.children.setdefault(digit, PhoneTrieNode())
+                node.keys[key] = node.keys.get(key, 0) + 1
+            node.owners.add(key)
+        self.phones_by_key[key] = phones
+
+    def remove(self, key):
+        for phone in self.phones_by_key.pop(key, ()):
+            path = [self.root]
+            for digit in phone:
+                path.append(path[-1].children[digit])
+            path[-1].owners.discard(key)
+            for node in path:
+                node.keys[key] -= 1
+                if not node.keys[key]:
+                    del node.keys[key]
+            for parent, digit, node in zip(path[-2::-1], phone[::-1], path[:0:-1]):
+                if node.keys:
+                    break
+                del parent.children[digit]
+
+    def clear(self):
+        self.root = PhoneTrieNode()
+        self.phones_by_key.clear()
+
+    def _node(self, prefix):
+        node = self.root
+        for digit in prefix:
+            node = node.children.get(digit)
+            if node is None:
+                return None
+        return node
+
+    def with_prefix(self, prefix):  # keys of records having a phone with the prefix
+        node = self._node(prefix)
+        return set(node.keys) if node else set()
+
+    def owners(self, number):  # keys of records owning exactly this number
+        node = self._node(number)
+        return set(node.owners) if node else set()
+
+# (month, day) ranges covering the next days, one day wider each side, bounds are inclusive.
+# Upcoming birthdays are one or two range scans of the birthday sort order
+def birthday_ranges(today, days):
+    if days < 0:
+        return []
+    if days + 2 >= 365:
+        return [((1, 1), (12, 31))]
+    first = today - timedelta(days=1)
+    last = today + timedelta(days=days + 1)
+    if first.year == last.year:
+        return [((first.month, first.day), (last.month, last.day))]
+    return [((first.month, first.day), (12, 31)), ((1, 1), (last.month, last.day))]
+
+# Tag -> notes index, notes are kept as (key, position of the note in record.notes)
+class TagIndex(IndexAbstraction):
+    def __init__(self):
+        self.notes_by_tag = defaultdict(dict)  # tag -> {key: positions of notes tagged with it}
+        self.tags_by_key = {}  # key -> tags stored for the record, used on removal
+        self.counts = {}  # tag -> quantity of notes tagged with it
+        self.sorted_tags = []  # every tag in use, sorted
+
+    def add(self, key, record):
+        tags = set()
+        for position, note in enumerate(record.notes):
+            for tag in set(note.tags):
+                self.notes_by_tag[tag].setdefault(key, []).append(position)
+                if tag not in self.counts:
+                    self.counts[tag] = 0
+                    bisect.insort(self.sorted_tags, tag)
+                self.counts[tag] += 1
+                tags.add(tag)
+        if tags:
+            self.tags_by_key[key] = tags
+
+    def remove(self, key):
+        for tag in self.tags_by_key.pop(key, ()):
+            self.counts[tag] -= len(self.notes_by_tag[tag].pop(key))
+            if not self.counts[tag]:
+                del self.counts[tag]
+                del self.notes_by_tag[tag]
+                del self.sorted_tags[bisect.bisect_left(self.sorted_tags, tag)]
+
+    def clear(self):
+        self.notes_by_tag.clear()
+        self.tags_by_key.clear()
+        self.counts.clear()
+        self.sorted_tags.clear()
+
+    def notes(self, tag):  # {key: positions of tagged notes}
+        return self.notes_by_tag.get(tag, {})
+
+# Full-text index of notes ranked by BM25, documents are (key, position of the note in record.notes).
+# Words are lowercased and Cyrillic is transliterated as in cleaner, so "Київ" matches its transliteration "kyyiv"
+class NoteTextIndex(IndexAbstraction):
+    SUFFIX = '.notes'  # index file is kept next to the snapshot
+    TOKEN = re.compile(r'\w+')
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.postings = defaultdict(dict)  # term -> {document: term frequency}
+        self.lengths = {}  # document -> quantity of terms
+        self.total_length = 0
+        self.terms_by_key = {}  # key -> {document: its terms}, used on removal
+        self.saved = None  # (filename, stamp) of the index file written or loaded last
+
+    @staticmethod
+    def fold(text):  # lowercased and transliterated text, SQLiteAddressBook indexes notes the same way
+        return text.lower().translate(TRANSLATE_TABLE)
+
+    @classmethod
+    def terms(cls, text):
+        return cls.TOKEN.findall(cls.fold(text))
+
+    def add(self, key, record):
+        documents = {}
+        for position, note in enumerate(record.notes):
+            terms = self.terms(note.value or '')
+            if not terms:
+                continue
+            document = (key, position)
+            for term in terms:
+                frequencies = self.postings[term]
+                frequencies[document] = frequencies.get(document, 0) + 1
+            self.lengths[document] = len(terms)
+            self.total_length += len(terms)
+            documents[document] = set(terms)
+        if documents:
+            self.terms_by_key[key] = documents
+
+    def remove(self, key):
+        for document, terms in self.terms_by_key.pop(key, {}).items():
+            self.total_length -= self.lengths.pop(document)
+            for term in terms:
+                frequencies = self.postings[term]
+                del frequencies[document]
+                if not frequencies:
+                    del self.postings[term]
+
+    def clear(self):
+        self.postings.clear()
+        self.lengths.clear()
+        self.total_length = 0
+        self.terms_by_key.clear()
+
+    def search(self, text, limit=None):  # [(score, document)] of notes having every word, best first
+        terms = set(self.terms(text))
+        if not terms or not self.lengths:
+            return []
+        frequencies = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        documents = set(frequencies[0]).intersection(*frequencies[1:])
+        count = len(self.lengths)
+        average_length = self.total_length / count
+        weights = [(math.log(1 + (count - len(term_frequencies) + 0.5) / (len(term_frequencies) + 0.5)),
+                    term_frequencies) for term_frequencies in frequencies]
+        scores = []
+        for document in documents:
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[document] / average_length)
+            score = 0.0
+            for idf, term_frequencies in weights:
+                frequency = term_frequencies[document]
+                score += idf * frequency * (self.K1 + 1) / (frequency + norm)
+            scores.append((score, document))
+        if limit is None:
+            return sorted(scores, key=lambda item: (-item[0], item[1]))
+        return heapq.nsmallest(limit, scores, key=lambda item: (-item[0], item[1]))
+
+    def save(self, filename, stamp):  # stamp identifies the snapshot the index belongs to
+        with open(f"{filename}{self.SUFFIX}", 'wb') as file_write:
+            pickle.dump((stamp, dict(self.postings), self.lengths, self.total_length, self.terms_by_key), file_write)
+        self.saved = (filename, stamp)
+
+    def load(self, filename, stamp):  # True if the saved index belongs to the snapshot with the stamp
+        try:
+            with open(f"{filename}{self.SUFFIX}", 'rb') as file_read:
+                saved_stamp, postings, lengths, total_length, terms_by_key = pickle.load(file_read)
+        except Exception:  # missing or damaged index is built again
+            return False
+        if saved_stamp != stamp:
+            return False
+        self.postings = defaultdict(dict, postings)
+        self.lengths = lengths
+        self.total_length = total_length
+        self.terms_by_key = terms_by_key
+        self.saved = (filename, stamp)
+        return True
+
+def levenshtein(first, second):  # edit distance with insertions, deletions and substitutions
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+# Node of the BK-tree, children are kept by their distance to the node name
+class NameNode:
+    __slots__ = ('name', 'keys', 'children')
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = set()  # keys of records with this lowercased name, empty after removal
+        self.children = {}
+
+# BK-tree of lowercased names over Levenshtein distance, a lookup visits only branches within the bound.
+# Removed names stay as routing nodes until they outnumber the live ones, then the tree is rebuilt
+class NameIndex(IndexAbstraction):
+    uses_record = False  # the key is the contact name
+
+    def __init__(self):
+        self.root = None
+        self.names_by_key = {}  # key -> lowercased name stored for the record
+        self.removed = 0  # nodes without keys
+
+    def add(self, key, record):
+        self.insert(key, key)
+
+    def insert(self, key, name):
+        name = name.lower()
+        self.names_by_key[key] = name
+        if self.root is None:
+            self.root = NameNode(name)
+            self.removed += 1  # counted as empty until the key is added below
+        node = self.root
+        while node.name != name:
+            distance = levenshtein(name, node.name)
+            child = node.children.get(distance)
+            if child is None:
+                child = node.children[distance] = NameNode(name)
+                self.removed += 1
+            node = child
+        if not node.keys:
+            self.removed -= 1
+        node.keys.add(key)
+
+    def remove(self, key):
+        name = self.names_by_key.pop(key, None)
+        if name is None:
+            return
+        node = self.root
+        while node.name != name:
+            node = node.children[levenshtein(name, node.name)]
+        node.keys.discard(key)
+        if not node.keys:
+            self.removed += 1
+            if self.removed > len(self.names_by_key):
+                self.rebuild()
+
+    def rebuild(self):
+        names_by_key = self.names_by_key
+        self.clear()
+        for key, name in names_by_key.items():
+            self.insert(key, name)
+
+    def clear(self):
+        self.root = None
+        self.names_by_key = {}
+        self.removed = 0
+
+    def closest(self, name, limit=5, max_distance=2):  # [(distance, key)] nearest first, ties by key
+        name = name.lower()
+        found = []  # heap of (-distance, key) keeps the best found
+        bound = max_distance
+        pending = [self.root] if self.root else []
+        while pending:
+            node = pending.pop()
+            distance = levenshtein(name, node.name)
+            if distance <= bound:
+                for key in node.keys:
+                    heapq.heappush(found, (-distance, _Reversed(key)))
+                    if len(found) > limit:
+                        heapq.heappop(found)
+                if len(found) == limit:
+                    bound = -found[0][0]  # farther names can't get into the result
+            for child_distance, child in node.children.items():
+                if distance - bound <= child_distance <= distance + bound:
+                    pending.append(child)
+        return sorted((-distance, key.value) for distance, key in found)
+
+# Heap item wrapper: among equal distances the greatest key leaves the heap first
+class _Reversed:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+# Keys ordered by sort_value(key, record), records with None value are not indexed.
+# Pages after a (value, key) position and value ranges are found with bisect, O(log n + k)
+class SortedIndex(IndexAbstraction):
+    def __init__(self, sort_value, uses_record=True):
+        self.sort_value = sort_value
+        self.uses_record = uses_record
+        self.entries = []  # sorted (value, key)
+        self.values_by_key = {}  # key -> value stored for the record, used on removal
+
+    def add(self, key, record):
+        value = self.sort_value(key, record)
+        if value is not None:
+            self.values_by_key[key] = value
+            bisect.insort(self.entries, (value, key))
+
+    def extend(self, items):  # bulk add, entries are sorted once
+        for key, record in items:
+            value = self.sort_value(key, record)
+            if value is not None:
+                self.values_by_key[key] = value
+                self.entries.append((value, key))
+        self.entries.sort()
+
+    def remove(self, key):
+        if key in self.values_by_key:
+            entry = (self.values_by_key.pop(key), key)
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+    def clear(self):
+        self.entries.clear()
+        self.values_by_key.clear()
+
+    def after(self, position=None, limit=None):  # (value, key) entries following the position
+        start = bisect.bisect_right(self.entries, position) if position is not None else 0
+        return self.entries[start:None if limit is None else start + limit]
+
+    def range(self, start=None, stop=None):  # keys with start <= value < stop, None is unbounded
+        first = 0 if start is None else bisect.bisect_left(self.entries, start, key=itemgetter(0))
+        last = len(self.entries) if stop is None else bisect.bisect_left(self.entries, stop, key=itemgetter(0))
+        return [key for value, key in self.entries[first:last]]
+
+    def rotated(self, start, limit):  # keys from the start value on, continued from the beginning
+        first = bisect.bisect_left(self.entries, start, key=itemgetter(0))
+        entries = self.entries[first:first + limit]
+        entries += self.entries[:min(limit - len(entries), first)]
+        return [key for value, key in entries]
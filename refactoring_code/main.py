@@ -1,7 +1,7 @@
 
 from cleaner import clean
 from address_book_part import AddressBook
-import os
+from sqlite_part import SQLiteAddressBook
 import re
 import time
 from rich import print
@@ -79,16 +79,16 @@ class BotUserInterface(UserInterfaceAbstraction):
                     choice = input("Choose an option: ")
                     if choice == '1':  # Edit whole contact
                         contact = input("Input whose contact to edit: ")
-                        record =  self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
-                            del self.address_book.data[contact]
+                            self.address_book.delete(contact)
                             new_reccord = self.address_book.get_contact()
                             self.address_book.add_record(new_reccord)
                             console.print('Contact modified and saved', style="success")
 
                     elif choice == '2':  # Edit email
                         contact = input("Input whose email to change: ")
-                        record = self.address_book.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             new_email = input("Input new email: ")
                             record.edit_email(new_email)
@@ -96,7 +96,7 @@ class BotUserInterface(UserInterfaceAbstraction):
                             
                     elif choice == '3':  # Add phone 
                         contact = input("Input whose phone add: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             print(record.phones)                        
                             new_phone = input("Input new phone: ")
@@ -105,7 +105,7 @@ class BotUserInterface(UserInterfaceAbstraction):
                     
                     elif choice == '4':  # Delete phone
                         contact = input("Input whose phone delete: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             print(record.phones)
                             new_phone = input("Input phone to delete: ")
@@ -120,7 +120,7 @@ class BotUserInterface(UserInterfaceAbstraction):
 #/////////////////////////////////////////////////////////////////////// 
             elif choice == '4':  # Delete contact
                 contact_name = input("Enter contact name to delete: ")
-                del self.address_book.data[contact_name]
+                self.address_book.delete(contact_name)
                 console.print('Contact was removed', style="success")
             
             elif choice == '5':  # Find contact
@@ -131,14 +131,13 @@ class BotUserInterface(UserInterfaceAbstraction):
                         console.print(result, style="success")
                 else:
                     console.print("Contact not found.", style="error")
+                    for record, distance in self.address_book.find_similar(query):
+                        console.print(f"Did you mean {record.name.value}?", style="warning")
 
             elif choice == '6':  # display_contacts_n_day_to birthday
                 n = int(input("Input quantity days to birthday: "))
-                for page in self.address_book:
-                    for record in page:
-                        m = record.days_to_birthday()
-                        if m <= n:
-                            console.print(f"To {record.name.value}s birthday {m} days", style='success')
+                for record, m in self.address_book.upcoming_birthdays(n):
+                    console.print(f"To {record.name.value}s birthday {m} days", style='success')
 # /////////////////////// NOTES MENU /////////////////////////                            
             elif choice == '7':
                 while True:
@@ -146,7 +145,7 @@ class BotUserInterface(UserInterfaceAbstraction):
                     choice = input("Choose an option: ")
                     if choice == '1':  # Add note
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             note = input("Input note: ")
                             tag = input("Input tag: ")
@@ -155,20 +154,20 @@ class BotUserInterface(UserInterfaceAbstraction):
 
                     elif choice == '2':  # Show all notes
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             console.print(record.show_notes(), style="success")
                     
                     elif choice == '3':  # Delete notes
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             keyword = input("Input keyword or tag of note for deletion: ")
                             console.print(record.delete_note(keyword), style="success")
 
                     elif choice == '4':  # Find note
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             keyword = input("Input keyword or tag for search: ")
                             result = record.find_note(keyword)
@@ -176,7 +175,7 @@ class BotUserInterface(UserInterfaceAbstraction):
 
                     elif choice == '5':  # Edit note
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             keyword = input("Input keyword or tag of note to edit: ")
                             note = input("Input new note: ")
@@ -187,13 +186,13 @@ class BotUserInterface(UserInterfaceAbstraction):
                         contact = input("Input contact name: ")
                         keyword = input("Input keyword or tag of note to edit: ")
                         tag = input("Input tag to add: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             console.print(record.add_tag(keyword, tag), style="success")
                     
                     elif choice == '7':  # Remove tag
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             keyword = input("Input keyword or tag of note to remove tag: ")
                             tag = input("Input tag to remove: ")
@@ -201,7 +200,7 @@ class BotUserInterface(UserInterfaceAbstraction):
                     
                     elif choice == '8':  # Sort notes via tag keyword
                         contact = input("Input contact name: ")
-                        record = self.address_book.data.get(contact)
+                        record = self.address_book.find(contact)
                         if record:
                             sorted_notes = record.sort_notes()
                             for note in sorted_notes:
@@ -231,19 +230,18 @@ class BotUserInterface(UserInterfaceAbstraction):
 
 
 if __name__=="__main__":
-    address_book = AddressBook()  # create object
-    filename = 'contacts.pkl'
+    filename = 'contacts.pkl'  # 'contacts.db' keeps contacts in SQLite database
+    address_book = SQLiteAddressBook() if filename.endswith('.db') else AddressBook()  # create object
     try:
-        if os.path.getsize(filename) > 0:  # check if file of data not empty
-            address_book.restore_from_file(filename)
+        address_book.restore_from_file(filename)  # snapshot plus journal of changes
     except Exception:
         f'First run, will be create file'
 
     for i in track(range(3), description="Loading data..."):
         print(f"loading {i}")
         time.sleep(0.5)
-ui= BotUserInterface(address_book)
-ui.run()
+    ui= BotUserInterface(address_book)
+    ui.run()
 
 
 
@@ -1,9 +1,11 @@
 from fields_part import Name, Birthday, Phone, Email, Address, Note
-from datetime import datetime
-import re
+from datetime import datetime, date
+import calendar
 from abc import abstractmethod, ABC
 
 class ReccordAbstraction(ABC):
+    __slots__ = ()
+
     @abstractmethod
     def __init__(self, name, phone, birthday, email, notes=None, address=None) -> None:
         self.name = Name(name)
@@ -48,7 +50,7 @@ class ReccordAbstraction(ABC):
     def sort_notes(self):
         pass
     @abstractmethod
-    def days_to_birthday(self):
+    def days_to_birthday(self, today=None):
         pass
 
     @abstractmethod
@@ -56,7 +58,10 @@ class ReccordAbstraction(ABC):
         pass
 
 class Record(ReccordAbstraction):
+    __slots__ = ('name', 'birthday', 'phone', 'phones', 'email', 'address', 'notes', '_book', '__weakref__')
+
     def __init__(self, name, phone, birthday, email, notes=None, address=None) -> None:
+        self._book = None  # AddressBook which holds the record, notified about changes
         self.name = Name(name)
         self.birthday = Birthday(birthday)
         self.phone = Phone(phone) if phone else None
@@ -65,23 +70,52 @@ class Record(ReccordAbstraction):
         self.address = Address(address)
         self.notes = [Note(notes)] if notes else []
 
+    @classmethod
+    def from_fields(cls, name, phones, birthday, email, notes, address):  # record of validated fields
+        record = cls.__new__(cls)
+        record._book = None
+        record.name = name
+        record.birthday = birthday
+        record.phones = phones
+        record.phone = phones[0] if phones else None
+        record.email = email
+        record.address = address
+        record.notes = notes
+        return record
+
+# Methods keep the address book indexes in sync with the record
+    def _changed(self):
+        if self._book is not None:
+            self._book.record_changed(self)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__ if not name.startswith('_')}
+
+    def __setstate__(self, state):  # same dict state as records pickled before slots
+        self._book = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
 # Methods for phone processing
     def add_phone(self, phone_number):
         phone = Phone(phone_number)
         if phone not in self.phones:
             self.phones.append(phone)
+            self._changed()
 
     def remove_phone(self, phone_number):
         phone = Phone(phone_number)
         for i in self.phones:
             if phone.value == i.value:
                 self.phones.remove(i)
+                self._changed()
                 return "phone is removed"
 
 # Methods for email changing
     def edit_email(self, new_email):
         new_email = Email(new_email)
         self.email = new_email
+        self._changed()
         return f"email:{self.email.value}"
 
 # Methods for notes and tags processing
@@ -96,11 +130,13 @@ class Record(ReccordAbstraction):
         for note in self.notes:
             if keyword.lower() in note.value:
                 self.notes.remove(note)
+                self._changed()
                 return f"Note was removed"
 
     def add_note(self, note, tag=None):
         new_note = Note(f"{note} #{tag}" if tag else f'{note}')
         self.notes.append(new_note)
+        self._changed()
         return f'notes: {"; ".join(note.value for note in self.notes) if self.notes else "N/A"}'
 
     def edit_note(self, keyword, note, tag=None):
@@ -109,45 +145,53 @@ class Record(ReccordAbstraction):
             if keyword.lower() in note.value:
                 self.notes.pop(i)
                 self.notes.insert(i, new_note_obj)
+                self._changed()
                 return f"Note was edited"
         return "Note not found."
 
     def add_tag(self, keyword, tag):
         for note in self.notes:
             if keyword.lower() in note.value:
-                existing_tags = re.findall(r'#(\w+)', note.value)
+                existing_tags = list(note.tags)
                 existing_tags.append(tag)
                 tags = "#".join(existing_tags)
                 note.value = f"{note.value.split('#')[0]}#{tags}"
+                self._changed()
                 return f"Tag was added"
         return f"Tag not found"
     
     def remove_tag(self, keyword, tag):
         for note in self.notes:
             if keyword.lower() in note.value:
-                existing_tags = re.findall(r'#(\w+)', note.value)
+                existing_tags = list(note.tags)
                 if tag in existing_tags:
                     existing_tags.remove(tag)
                     tags = "#".join(existing_tags)
                     note.value = f"{note.value.split('#')[0]}#{tags}"
+                    self._changed()
                     return f"Tag was removed from the note"
         return f"Tag not found"
     
     def sort_notes(self):
-        sorted_notes = sorted(self.notes, key=lambda note: re.findall(r'#(\w+)', note.value))
+        sorted_notes = sorted(self.notes, key=lambda note: note.tags)
         self.notes = sorted_notes
+        self._changed()  # note positions are journaled and indexed
         return sorted_notes
     
-# Methods defines days to birthdays of the contact
-    def days_to_birthday(self):
-        if self.birthday:
-            date_now = datetime.now().date()
-            user_next_birthday = datetime(
-                date_now.year, self.birthday.value.month, self.birthday.value.day).date()
-            user_next_year = user_next_birthday.replace(year=date_now.year + 1)
-            delta = user_next_birthday - \
-                date_now if user_next_birthday >= date_now else user_next_year - date_now
-            return delta.days
+# Methods defines days to birthdays of the contact, today is passed by bulk queries
+    def days_to_birthday(self, today=None):
+        if self.birthday and self.birthday.value:
+            date_now = today or datetime.now().date()
+            user_next_birthday = self.birthday_in_year(date_now.year)
+            if user_next_birthday < date_now:
+                user_next_birthday = self.birthday_in_year(date_now.year + 1)
+            return (user_next_birthday - date_now).days
+
+    def birthday_in_year(self, year):  # Feb 29 birthday is celebrated on Mar 1 in common years
+        birthday = self.birthday.value
+        if birthday.month == 2 and birthday.day == 29 and not calendar.isleap(year):
+            return date(year, 3, 1)
+        return date(year, birthday.month, birthday.day)
 
     def __str__(self) -> str:
         return (
@@ -0,0 +1,337 @@
+from address_book_part import AddressBookAbstraction, encode_cursor, decode_cursor
+from record_part import Record
+from fields_part import Name, Birthday, Phone, Email, Address, Note
+from index_part import NameIndex, NoteTextIndex, birthday_ranges
+from weakref import WeakValueDictionary
+import re
+import sqlite3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    birthday TEXT,
+    birthday_month INTEGER,
+    birthday_day INTEGER,
+    email TEXT,
+    address TEXT
+);
+CREATE INDEX IF NOT EXISTS records_birthday ON records (birthday_month, birthday_day);
+CREATE INDEX IF NOT EXISTS records_email_domain ON records (lower(substr(email, instr(email, '@') + 1)));
+CREATE TABLE IF NOT EXISTS phones (
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    phone TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phones_record ON phones (record_id);
+CREATE INDEX IF NOT EXISTS phones_phone ON phones (phone);
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    record_id INTEGER NOT NULL REFERENCES records (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_record ON notes (record_id);
+CREATE TABLE IF NOT EXISTS tags (
+    note_id INTEGER NOT NULL REFERENCES notes (id) ON DELETE CASCADE,
+    record_id INTEGER NOT NULL,
+    tag TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE INDEX IF NOT EXISTS tags_note ON tags (note_id);
+'''
+
+# Full-text index of notes folded by py_fold like AddressBook note search, so "kyyiv" finds "Київ".
+# Created again with the folded text of every note when the database has the older unfolded one
+FTS_SCHEMA = '''
+DROP TRIGGER IF EXISTS notes_fts_insert;
+DROP TRIGGER IF EXISTS notes_fts_delete;
+DROP TABLE IF EXISTS notes_fts;
+CREATE VIRTUAL TABLE notes_fts USING fts5 (text, content='');
+CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, text) VALUES (new.id, py_fold(new.text));
+END;
+CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, text) VALUES ('delete', old.id, py_fold(old.text));
+END;
+INSERT INTO notes_fts (rowid, text) SELECT id, py_fold(text) FROM notes;
+'''
+
+BATCH_SIZE = 1000  # records of iter_records read with one query of their phones and one of notes
+
+# Query for AddressBook.search semantics: substring of name, phone or note
+SEARCH_QUERY = '''
+SELECT * FROM records WHERE instr(py_lower(name), :query)
+    OR id IN (SELECT record_id FROM phones WHERE instr(phone, :query))
+    OR id IN (SELECT record_id FROM notes WHERE instr(py_lower(text), :query))
+ORDER BY id
+'''
+
+# Class store contacts in SQLite database, records are loaded only on request
+class SQLiteAddressBook(AddressBookAbstraction):
+    SORT_ORDERS = {  # sort order -> indexed expressions, id breaks ties
+        'added': ('id',),
+        'name': ('name',),
+        'birthday': ('birthday_month', 'birthday_day'),
+        'email': ("lower(substr(email, instr(email, '@') + 1))",),
+    }
+    def __init__(self, filename=':memory:'):
+        self.filename = None
+        self.connection = None
+        self.records = WeakValueDictionary()  # name -> loaded record, one object per contact
+        self.name_index = None  # BK-tree of names, built by the first find_similar
+        self.restore_from_file(filename)
+
+    def restore_from_file(self, filename):  # open (or create) the database
+        if self.connection is not None:
+            self.connection.close()
+        self.connection = sqlite3.connect(filename)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.create_function(
+            'py_lower', 1, lambda value: value.lower() if value is not None else None, deterministic=True)
+        self.connection.create_function('py_fold', 1, NoteTextIndex.fold, deterministic=True)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        fts = self.connection.execute("SELECT sql FROM sqlite_master WHERE name = 'notes_fts'").fetchone()
+        if fts is None or "content=''" not in fts[0]:
+            self.connection.executescript(FTS_SCHEMA)
+        self.filename = filename
+        self.records.clear()
+        self.name_index = None
+
+    def save_to_file(self, filename):  # changes are committed at once, copy to other file
+        self.connection.commit()
+        if filename != self.filename:
+            target = sqlite3.connect(filename)
+            with target:
+                self.connection.backup(target)
+            target.close()
+        return f'exit'
+
+# Methods convert records between objects and table rows
+    def _load(self, row):
+        record = self.records.get(row['name'])
+        if record is not None:
+            return record
+        record = Record(row['name'], None, row['birthday'], row['email'], None, row['address'])
+        record.phones = [Phone(phone) for (phone,) in self.connection.execute(
+            'SELECT phone FROM phones WHERE record_id = ? ORDER BY position', (row['id'],))]
+        record.phone = record.phones[0] if record.phones else None
+        record.notes = [Note(text) for (text,) in self.connection.execute(
+            'SELECT text FROM notes WHERE record_id = ? ORDER BY position', (row['id'],))]
+        record._book = self
+        self.records[row['name']] = record
+        return record
+
+    def _store(self, record):
+        birthday = record.birthday.value
+        self.connection.execute(
+            '''INSERT INTO records (name, birthday, birthday_month, birthday_day, email, address)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET birthday = excluded.birthday,
+                birthday_month = excluded.birthday_month, birthday_day = excluded.birthday_day,
+                email = excluded.email, address = excluded.address''',
+            (record.name.value, birthday.isoformat() if birthday else None,
+             birthday.month if birthday else None, birthday.day if birthday else None,
+             record.email.value if record.email else None,
+             record.address.value if record.address else None))
+        record_id = self.connection.execute(
+            'SELECT id FROM records WHERE name = ?', (record.name.value,)).fetchone()[0]
+        self.connection.execute('DELETE FROM phones WHERE record_id = ?', (record_id,))
+        self.connection.execute('DELETE FROM notes WHERE record_id = ?', (record_id,))
+        self.connection.executemany(
+            'INSERT INTO phones (record_id, position, phone) VALUES (?, ?, ?)',
+            [(record_id, position, phone.value) for position, phone in enumerate(record.phones)])
+        for position, note in enumerate(record.notes):
+            note_id = self.connection.execute(
+                'INSERT INTO notes (record_id, position, text) VALUES (?, ?, ?)',
+                (record_id, position, note.value)).lastrowid
+            self.connection.executemany(
+                'INSERT INTO tags (note_id, record_id, tag) VALUES (?, ?, ?)',
+                [(note_id, record_id, tag) for tag in set(note.tags)])
+
+    def _select(self, query, parameters=()):
+        return [self._load(row) for row in self.connection.execute(query, parameters).fetchall()]
+
+# Methods for contacts processing, same API as AddressBook
+    def add_record(self, record: Record):
+        with self.connection:
+            self._store(record)
+        self._attach(record)
+        return f"Contact {record.name.value} added"
+
+    def add_records(self, records):  # bulk add in one transaction
+        records = list(records)
+        with self.connection:
+            for record in records:
+                self._store(record)
+        for record in records:
+            self._attach(record)
+        return f"{len(records)} contacts added"
+
+    def _attach(self, record):
+        if self.name_index is not None:
+            self.name_index.insert(record.name.value, record.name.value)
+        old_record = self.records.get(record.name.value)
+        if old_record is not None and old_record is not record:
+            old_record._book = None
+        self.records[record.name.value] = record
+        record._book = self
+
+    def record_changed(self, record):  # called by Record after each mutation
+        if self.records.get(record.name.value) is record:
+            with self.connection:
+                self._store(record)
+
+    def find(self, name):
+        row = self.connection.execute('SELECT * FROM records WHERE name = ?', (name,)).fetchone()
+        return self._load(row) if row else None
+
+    def delete(self, name):
+        with self.connection:
+            deleted = self.connection.execute('DELETE FROM records WHERE name = ?', (name,)).rowcount
+        if not deleted:
+            raise KeyError(f"Contact '{name}' not found.")
+        record = self.records.pop(name, None)
+        if record is not None:
+            record._book = None
+        if self.name_index is not None:
+            self.name_index.remove(name)
+        return f'Record {name} deleted'
+
+    def search(self, query):
+        return self._select(SEARCH_QUERY, {'query': query.lower()})
+
+    def find_similar(self, name, limit=5, max_distance=2):  # (record, distance) of names with typos, nearest first
+        if self.name_index is None:
+            self.name_index = NameIndex()
+            for (record_name,) in self.connection.execute('SELECT name FROM records'):
+                self.name_index.insert(record_name, record_name)
+        return [(self.find(key), distance) for distance, key in self.name_index.closest(name, limit, max_distance)]
+
+    def find_by_phone_prefix(self, prefix):  # records with a phone starting from prefix
+        return self._select(
+            '''SELECT * FROM records WHERE id IN
+            (SELECT record_id FROM phones WHERE phone >= ? AND phone < ?) ORDER BY id''',
+            (prefix, f"{prefix}\U0010ffff"))
+
+    def find_by_phone(self, number):  # records who own the phone number
+        return self._select(
+            'SELECT * FROM records WHERE id IN (SELECT record_id FROM phones WHERE phone = ?) ORDER BY id',
+            (number,))
+
+    def find_by_birthday(self, month, day):  # records with birthday on the day of any year
+        return self._select(
+            'SELECT * FROM records WHERE birthday_month = ? AND birthday_day = ? ORDER BY id', (month, day))
+
+    def birthday_candidates(self, today, days):  # range scan of the birthday index
+        records = []
+        for first, last in birthday_ranges(today, days):
+            records += self._select(
+                '''SELECT * FROM records WHERE (birthday_month, birthday_day) BETWEEN (?, ?) AND (?, ?)
+                ORDER BY birthday_month, birthday_day, id''', (*first, *last))
+        return records
+
+    def find_by_tag(self, tag):  # records with at least one note tagged #tag
+        return self._select(
+            'SELECT * FROM records WHERE id IN (SELECT record_id FROM tags WHERE tag = ?) ORDER BY id', (tag,))
+
+    def notes_tagged(self, tag):  # (record, note) of every note tagged #tag
+        rows = self.connection.execute(
+            '''SELECT records.*, notes.position FROM tags JOIN notes ON notes.id = tags.note_id
+            JOIN records ON records.id = notes.record_id WHERE tags.tag = ? ORDER BY records.id, notes.position''',
+            (tag,)).fetchall()
+        result = []
+        for row in rows:
+            record = self._load(row)
+            result.append((record, record.notes[row['position']]))
+        return result
+
+    def tag_counts(self):  # tag -> quantity of notes tagged with it, in alphabetical order
+        return dict(self.connection.execute('SELECT tag, count(*) FROM tags GROUP BY tag ORDER BY tag').fetchall())
+
+    def search_notes(self, text, limit=None):  # full-text search of notes having every word, best match first
+        words = re.findall(r'\w+', NoteTextIndex.fold(text))
+        if not words:
+            return []
+        query = ' '.join(f'"{word}"' for word in words)  # words are quoted, FTS5 syntax isn't parsed
+        return self._select(
+            '''SELECT records.* FROM records JOIN
+            (SELECT notes.record_id, min(matched.rank) AS rank FROM notes JOIN
+                (SELECT rowid, rank FROM notes_fts WHERE notes_fts MATCH ?) AS matched
+                ON matched.rowid = notes.id GROUP BY notes.record_id) AS found ON found.record_id = records.id
+            ORDER BY found.rank, records.id LIMIT ?''',
+            (query, -1 if limit is None else limit))
+
+    def iter_records(self):  # one ordered pass, records not loaded are read for the pass only, use find() to edit them
+        rows = self.connection.execute('SELECT * FROM records ORDER BY id')
+        while batch := rows.fetchmany(BATCH_SIZE):
+            bounds = (batch[0]['id'], batch[-1]['id'])  # ids of the batch are consecutive in the table
+            phones, notes = {}, {}
+            for record_id, phone in self.connection.execute(
+                    'SELECT record_id, phone FROM phones WHERE record_id BETWEEN ? AND ? ORDER BY record_id, position',
+                    bounds):
+                phones.setdefault(record_id, []).append(Phone.from_valid(phone))
+            for record_id, text in self.connection.execute(
+                    'SELECT record_id, text FROM notes WHERE record_id BETWEEN ? AND ? ORDER BY record_id, position',
+                    bounds):
+                notes.setdefault(record_id, []).append(Note.from_valid(text))
+            for row in batch:
+                record = self.records.get(row['name'])
+                if record is None:
+                    record = Record.from_fields(
+                        Name.from_valid(row['name']), phones.get(row['id'], []), Birthday(row['birthday']),
+                        Email.from_valid(row['email']), notes.get(row['id'], []), Address.from_valid(row['address']))
+                yield record
+
+    def __len__(self):
+        return self.connection.execute('SELECT count(*) FROM records').fetchone()[0]
+
+    def __contains__(self, name):
+        return self.connection.execute('SELECT 1 FROM records WHERE name = ?', (name,)).fetchone() is not None
+
+# Methods for page view of the contact list, every page is one indexed range query
+    def _sort_expressions(self, sort):
+        expressions = self.SORT_ORDERS.get(sort)
+        if expressions is None:
+            raise ValueError(f"Unknown sort order '{sort}'")
+        return expressions
+
+    def _sorted(self, sort, condition, parameters, limit=-1):
+        # rows with (sort values, id) matching condition in sort order, values are selected as sort_0, ...
+        expressions = self._sort_expressions(sort)
+        values = ', '.join(f'{expression} AS sort_{i}' for i, expression in enumerate(expressions))
+        order = ', '.join((*expressions, 'id'))
+        not_null = ' AND '.join(f'{expression} IS NOT NULL' for expression in expressions)
+        return self.connection.execute(
+            f'SELECT *, {values} FROM records WHERE {not_null} AND {condition} ORDER BY {order} LIMIT ?',
+            (*parameters, limit)).fetchall()
+
+    def page(self, cursor=None, page_size=None, sort='added'):  # (records, cursor after the last of them)
+        expressions = self._sort_expressions(sort)
+        if cursor:
+            value, key = decode_cursor(cursor, sort)
+            rows = self._sorted(sort, f"({', '.join((*expressions, 'id'))}) > ({', '.join('?' * (len(expressions) + 1))})",
+                                (*value, key), page_size or self.PAGE_SIZE)
+        else:
+            rows = self._sorted(sort, '1', (), page_size or self.PAGE_SIZE)
+        if rows:
+            cursor = encode_cursor(sort, [rows[-1][f'sort_{i}'] for i in range(len(expressions))], rows[-1]['id'])
+        return [self._load(row) for row in rows], cursor
+
+    def range(self, sort, start=None, stop=None):  # records with start <= sort value < stop, e.g. ('name', 'K', 'N')
+        columns = f"({', '.join(self._sort_expressions(sort))})"
+        conditions = ['1']
+        parameters = []
+        for bound, operator in ((start, '>='), (stop, '<')):
+            if bound is not None:
+                bound = bound if isinstance(bound, tuple) else (bound,)
+                conditions.append(f"{columns} {operator} ({', '.join('?' * len(bound))})")
+                parameters += bound
+        return [self._load(row) for row in self._sorted(sort, ' AND '.join(conditions), parameters)]
+
+    def __iter__(self):
+        return self.pages()
+
+    def __repr__(self):
+        return f"SQLiteAddressBook({self.filename})"
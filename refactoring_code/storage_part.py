@@ -0,0 +1,191 @@
+from collections.abc import MutableMapping
+import mmap
+import os
+import pickle
+import struct
+
+def file_stamp(filename):  # (size, modification time) identifying the file version, None if it is absent
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Append-only journal of AddressBook mutations, stored next to the snapshot file
+class Journal:
+    SUFFIX = '.log'
+
+    def __init__(self, snapshot_filename, sync_every=32):
+        self.filename = f"{snapshot_filename}{self.SUFFIX}"
+        self.sync_every = sync_every  # fsync once per this quantity of entries
+        self.entries = 0  # entries written since the last compaction
+        self.unsynced = 0
+        self.file = None
+
+    def replay(self):  # yield (operation, key, record) entries, a torn tail is cut off
+        self.entries = 0
+        try:
+            file_read = open(self.filename, 'r+b')
+        except FileNotFoundError:
+            return
+        with file_read:
+            valid_size = 0
+            while True:
+                try:
+                    entry = pickle.load(file_read)
+                except Exception:  # end of file or partially written entry
+                    break
+                valid_size = file_read.tell()
+                self.entries += 1
+                yield entry
+            file_read.truncate(valid_size)
+
+    def append(self, operation, key, record=None):
+        if self.file is None:
+            self.file = open(self.filename, 'ab')
+        pickle.dump((operation, key, record), self.file)
+        self.file.flush()
+        self.entries += 1
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def extend(self, entries):  # bulk append of (operation, key, record), flushed once
+        if self.file is None:
+            self.file = open(self.filename, 'ab')
+        written = 0
+        for entry in entries:
+            pickle.dump(entry, self.file)
+            written += 1
+        self.file.flush()
+        self.entries += written
+        self.unsynced += written
+        if self.unsynced >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def truncate(self):  # called after the snapshot holds every journaled change
+        self.close()
+        open(self.filename, 'wb').close()
+        self.entries = 0
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+# Contacts snapshot: record blobs, offset index and trailer, read through mmap.
+# Records are decoded on first access, untouched ones stay as bytes in the file
+class SnapshotRecords(MutableMapping):
+    MAGIC = b'ABK1'
+    TRAILER = struct.Struct('<Q')  # offset of the pickled index
+
+    def __init__(self, on_load=None):
+        self.entries = {}  # key -> Record, or (offset, length) of not decoded record blob
+        self.modified = {}  # key -> modification sequence number read from the file
+        self.on_load = on_load  # called with every record decoded from the file
+        self.filename = None
+        self.file = None
+        self.map = None
+
+    def open(self, filename):  # map the snapshot, old whole-dict pickle files are read at once
+        self.close()
+        self.entries = {}
+        self.modified = {}
+        self.filename = filename
+        if not os.path.exists(filename) or os.path.getsize(filename) == 0:
+            return
+        with open(filename, 'rb') as file_read:
+            is_mapped_format = file_read.read(len(self.MAGIC)) == self.MAGIC
+            if not is_mapped_format:
+                file_read.seek(0)
+                self.entries = dict(pickle.load(file_read))
+                for record in self.entries.values():
+                    self._loaded(record)
+                return
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (index_offset,) = self.TRAILER.unpack_from(self.map, len(self.map) - self.TRAILER.size)
+        for key, offset, length, *modified in pickle.loads(self.map[index_offset:len(self.map) - self.TRAILER.size]):
+            self.entries[key] = (offset, length)
+            if modified:  # files written before modification order was kept have no sequence
+                self.modified[key] = modified[0]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
+
+    def save(self, filename, modified=None):  # atomic replace, a crash keeps the old snapshot
+        # modified maps key -> modification sequence number stored in the offset index
+        modified = modified or {}
+        temp_filename = f"{filename}.tmp"
+        index = []
+        with open(temp_filename, 'wb') as file_write:
+            file_write.write(self.MAGIC)
+            for key, value in self.entries.items():
+                blob = self.map[value[0]:value[0] + value[1]] if isinstance(value, tuple) else pickle.dumps(value)
+                index.append((key, file_write.tell(), len(blob), modified.get(key)))
+                file_write.write(blob)
+            index_offset = file_write.tell()
+            pickle.dump(index, file_write)
+            file_write.write(self.TRAILER.pack(index_offset))
+            file_write.flush()
+            os.fsync(file_write.fileno())
+        if filename != self.filename:
+            os.replace(temp_filename, filename)
+            return
+        self.close()  # mapped file can't be replaced on every platform
+        os.replace(temp_filename, filename)
+        self.file = open(filename, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        for key, offset, length, _ in index:
+            if isinstance(self.entries[key], tuple):
+                self.entries[key] = (offset, length)
+
+    def loaded(self, key):  # record if it is already decoded, without touching the file
+        value = self.entries.get(key)
+        return None if isinstance(value, tuple) else value
+
+    def peek(self, key):  # record without keeping it decoded, for one pass over every record
+        value = self.entries[key]
+        return pickle.loads(self.map[value[0]:value[0] + value[1]]) if isinstance(value, tuple) else value
+
+    def _loaded(self, record):
+        if self.on_load is not None:
+            self.on_load(record)
+        return record
+
+    def __getitem__(self, key):
+        value = self.entries[key]
+        if isinstance(value, tuple):
+            value = self._loaded(pickle.loads(self.map[value[0]:value[0] + value[1]]))
+            self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, record):
+        self.entries[key] = record
+
+    def __delitem__(self, key):
+        del self.entries[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
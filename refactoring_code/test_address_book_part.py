@@ -0,0 +1,25 @@
+from address_book_part import AddressBook
+from record_part import Record
+
+
+def tagged_notes(book, tag):
+    return [note.value for record, note in book.notes_tagged(tag)]
+
+def test_sort_notes_keeps_tag_index_positions():
+    book = AddressBook()
+    record = Record("Ann Lee", None, None, "ann@gmail.com", "zzz #b")
+    record.add_note("aaa", "a")
+    book.add_record(record)
+    record.sort_notes()
+    assert [note.value for note in record.notes] == ['aaa #a', 'zzz #b']
+    assert tagged_notes(book, 'a') == ['aaa #a']
+    assert tagged_notes(book, 'b') == ['zzz #b']
+
+def test_sort_notes_keeps_note_search_positions():
+    book = AddressBook()
+    record = Record("Ann Lee", None, None, "ann@gmail.com", "zzz river")
+    record.add_note("aaa lake")
+    book.add_record(record)
+    record.sort_notes()
+    positions = [position for score, (key, position) in book.note_index.search('lake')]
+    assert [record.notes[position].value for position in positions] == ['aaa lake']